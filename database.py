@@ -1,11 +1,16 @@
+import asyncio
+import collections
 import chromadb
 import os
+import sys
+import numpy as np
+from functools import lru_cache
 from logging_config import logger
 
 # Lee el host de ChromaDB desde las variables de entorno definidas en docker-compose.yml
 CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
 
-logger.info(f"Intentando conectar con ChromaDB en el host: {CHROMA_HOST}")
+logger.info("Intentando conectar con ChromaDB en el host: %s", CHROMA_HOST)
 
 try:
     # Inicializa el cliente de ChromaDB para conectarse al servidor
@@ -13,15 +18,91 @@ try:
     logger.info("Conexión con ChromaDB establecida exitosamente.")
 
 except Exception as e:
-    logger.critical(f"No se pudo conectar a ChromaDB en '{CHROMA_HOST}': {e}", exc_info=True)
+    logger.critical("No se pudo conectar a ChromaDB en '%s': %s", CHROMA_HOST, e, exc_info=True)
     client = None
 
-def save_chunks_to_db(collection_name: str, filename: str, file_hash: str, chunks: list, embeddings: list):
+# Cliente asíncrono usado para las inserciones. Se inicializa en el arranque de la
+# aplicación (lifespan de FastAPI) porque su creación es una corrutina.
+async_client = None
+
+# Las inserciones grandes se dividen en lotes que se envían concurrentemente,
+# limitando el número de peticiones simultáneas contra el servidor de ChromaDB.
+ADD_BATCH_SIZE = 128
+MAX_CONCURRENT_ADDS = 8
+
+# Cache de los handles de colección para no pedir la colección al servidor en cada
+# petición. Se invalida al borrar una colección en clear_collection.
+_collection_cache = {}
+_async_collection_cache = {}
+
+def _get_collection(collection_name: str):
+    """
+    Devuelve el handle (cacheado) de una colección, creándola si no existe.
+    """
+    collection = _collection_cache.get(collection_name)
+    if collection is None:
+        collection = client.get_or_create_collection(name=collection_name)
+        _collection_cache[collection_name] = collection
+    return collection
+
+async def _get_async_collection(collection_name: str):
+    """
+    Devuelve el handle asíncrono (cacheado) de una colección, creándola si no existe.
+    """
+    collection = _async_collection_cache.get(collection_name)
+    if collection is None:
+        collection = await async_client.get_or_create_collection(name=collection_name)
+        _async_collection_cache[collection_name] = collection
+    return collection
+
+def _files_collection_name(collection_name: str) -> str:
+    """
+    Nombre de la colección auxiliar que guarda una sola entrada por archivo procesado.
+    """
+    return f"{collection_name}__files"
+
+# ChromaDB exige un embedding por entrada; la colección de archivos solo se consulta
+# por ID y metadatos, así que se usa un vector constante de una dimensión.
+_FILE_ENTRY_EMBEDDING = [0.0]
+
+# ID de la entrada de la colección de archivos que indica que ya se registraron los
+# archivos guardados antes de que existiera (ver _backfill_files_collection). No puede
+# coincidir con un hash, que solo tiene dígitos hexadecimales.
+_FILES_BACKFILL_MARKER_ID = "__backfill_done__"
+
+# Longitud en hexadecimal de los hashes SHA-256 usados antes de migrar a BLAKE3 (128 bits).
+_LEGACY_HASH_LENGTH = 64
+
+def _chunk_ids(file_hash: str, num_chunks: int) -> list:
+    """
+    Genera los IDs deterministas de los chunks de un archivo a partir de su hash:
+    el hash seguido del índice del chunk en hexadecimal (mínimo 4 dígitos). Como el
+    hash tiene longitud fija no hace falta separador.
+    """
+    # Se construyen de forma vectorizada con numpy en lugar de formatear cada string en Python.
+    if len(file_hash) == _LEGACY_HASH_LENGTH:
+        # Archivos guardados con SHA-256 usaban el formato '<hash>-<índice decimal>'.
+        return np.char.add(f"{file_hash}-", np.arange(num_chunks).astype(str)).tolist()
+    return np.char.add(file_hash, np.char.mod("%04x", np.arange(num_chunks))).tolist()
+
+async def connect_async_client():
+    """
+    Inicializa el cliente asíncrono de ChromaDB usado para guardar los chunks.
+    """
+    global async_client
+    try:
+        async_client = await chromadb.AsyncHttpClient(host=CHROMA_HOST, port=8000)
+        logger.info("Cliente asíncrono de ChromaDB inicializado exitosamente.")
+    except Exception as e:
+        logger.critical("No se pudo crear el cliente asíncrono de ChromaDB en '%s': %s", CHROMA_HOST, e, exc_info=True)
+        async_client = None
+
+async def save_chunks_to_db(collection_name: str, filename: str, file_hash: str, chunks: list, embeddings: np.ndarray):
     """
     Guarda los chunks, embeddings y metadatos (incluyendo el hash del archivo) 
     en una colección específica de ChromaDB.
     """
-    if not client:
+    if not async_client:
         logger.error("La conexión con la base de datos no está disponible. No se guardarán los chunks.")
         return 0
     
@@ -30,54 +111,115 @@ def save_chunks_to_db(collection_name: str, filename: str, file_hash: str, chunk
         return 0
 
     try:
-        collection = client.get_or_create_collection(name=collection_name)
-        logger.info(f"Colección '{collection_name}' lista para la inserción.")
+        collection = await _get_async_collection(collection_name)
+        logger.info("Colección '%s' lista para la inserción.", collection_name)
     except Exception as e:
-        logger.error(f"No se pudo obtener o crear la colección '{collection_name}': {e}", exc_info=True)
+        logger.error("No se pudo obtener o crear la colección '%s': %s", collection_name, e, exc_info=True)
         return 0
 
+    # Se internan los strings constantes para que todos los metadatos de los chunks
+    # (y de peticiones posteriores con el mismo archivo) compartan una sola copia.
+    filename = sys.intern(filename)
+    file_hash = sys.intern(file_hash)
+
     # Genera IDs únicos y deterministas basados en el hash del contenido del archivo.
-    ids = [f"{file_hash}-{i}" for i in range(len(chunks))]
-    # Añade el hash del archivo a los metadatos de cada chunk.
-    metadatas = [
-        {"source_filename": filename, "file_hash": file_hash, "chunk_index": i} 
-        for i in range(len(chunks))
-    ]
+    ids = _chunk_ids(file_hash, len(chunks))
+    # Añade el hash del archivo a los metadatos de cada chunk. La parte constante se
+    # construye una sola vez y solo se sobrescribe el índice del chunk.
+    # "normalized" indica que los embeddings tienen norma 1, así que el coseno es un producto punto.
+    base_metadata = {"source_filename": filename, "file_hash": file_hash, "normalized": True}
+    metadatas = [{**base_metadata, "chunk_index": i} for i in range(len(chunks))]
     
     try:
-        logger.info(f"Guardando {len(chunks)} chunks del archivo '{filename}' en la colección '{collection_name}'.")
-        # Usamos 'add' que funciona como "upsert". Si los IDs ya existen, se sobrescriben.
-        collection.add(
-            embeddings=embeddings,
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
+        logger.info("Guardando %d chunks del archivo '%s' en la colección '%s'.", len(chunks), filename, collection_name)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_ADDS)
+        # Inicio de cada lote que esta llamada llegó a enviar (escrito o en curso al fallar).
+        sent_batches = []
+
+        async def add_batch(start: int):
+            end = start + ADD_BATCH_SIZE
+            async with semaphore:
+                sent_batches.append(start)
+                # Usamos 'add' que funciona como "upsert". Si los IDs ya existen, se sobrescriben.
+                await collection.add(
+                    embeddings=embeddings[start:end],
+                    documents=chunks[start:end],
+                    metadatas=metadatas[start:end],
+                    ids=ids[start:end]
+                )
+
+        tasks = [asyncio.ensure_future(add_batch(start)) for start in range(0, len(chunks), ADD_BATCH_SIZE)]
+        try:
+            await asyncio.gather(*tasks)
+
+            # Registra el archivo en la colección auxiliar (una entrada por archivo, con el hash como ID)
+            # para poder listar los archivos sin recorrer todos los chunks.
+            files_collection = await _get_async_collection(_files_collection_name(collection_name))
+            await files_collection.upsert(
+                ids=[file_hash],
+                embeddings=[_FILE_ENTRY_EMBEDDING],
+                metadatas=[{"filename": filename, "file_hash": file_hash, "chunk_count": len(chunks)}]
+            )
+        except BaseException:
+            # Si un lote falla, gather no detiene los demás: se cancelan los que siguen en
+            # curso y se borran los chunks ya escritos, para no dejar chunks de un archivo
+            # que no figura en la colección de archivos. (asyncio.TaskGroup haría esto,
+            # pero requiere Python 3.11 y la imagen usa 3.10.)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            sent_ids = [chunk_id for start in sorted(sent_batches) for chunk_id in ids[start:start + ADD_BATCH_SIZE]]
+            await _delete_partial_chunks(collection, collection_name, file_hash, sent_ids)
+            raise
+
+        _bump_files_generation(collection_name)
         logger.info("Chunks guardados en la base de datos exitosamente.")
         return len(chunks)
     except Exception as e:
-        logger.error(f"Error al guardar chunks en ChromaDB: {e}", exc_info=True)
+        logger.error("Error al guardar chunks en ChromaDB: %s", e, exc_info=True)
         return 0
 
-def check_if_hash_exists(collection_name: str, file_hash: str) -> bool:
+async def _delete_partial_chunks(collection, collection_name: str, file_hash: str, ids: list):
+    """
+    Borra por ID los chunks que envió un guardado que falló a medias. Los errores se
+    registran pero no se propagan, para no ocultar el error original del guardado.
+
+    Los IDs dependen solo del hash, así que si otra subida simultánea del mismo archivo
+    ya terminó (su entrada figura en la colección de archivos) esos chunks son suyos y
+    no se borran.
+    """
+    if not ids:
+        return
+    try:
+        files_collection = await _get_async_collection(_files_collection_name(collection_name))
+        if (await files_collection.get(ids=[file_hash]))["ids"]:
+            logger.warning("Guardado fallido, pero el archivo ya fue guardado por otra petición; no se borran sus chunks.")
+            return
+        await collection.delete(ids=ids)
+        logger.warning("Guardado fallido: se borraron los chunks parciales de la colección '%s'.", collection_name)
+    except Exception as e:
+        logger.error("No se pudieron borrar los chunks parciales de la colección '%s': %s", collection_name, e, exc_info=True)
+
+async def check_if_hash_exists(collection_name: str, file_hash: str) -> bool:
     """
     Verifica si algún documento con un file_hash específico ya existe en la colección.
+    Usa el cliente asíncrono para no bloquear el event loop durante la subida.
     """
-    if not client:
+    if not async_client:
         logger.error("La conexión con la base de datos no está disponible. No se puede verificar el hash.")
         return False
     
     try:
-        collection = client.get_collection(name=collection_name)
-        # Usamos un filtro 'where' para buscar metadatos que coincidan con el hash.
-        # Limitamos a 1 porque solo necesitamos saber si existe al menos uno.
-        results = collection.get(where={"file_hash": file_hash}, limit=1)
+        files_collection = await _get_async_collection(_files_collection_name(collection_name))
+        # El hash es el ID de la entrada en la colección de archivos, así que basta una
+        # búsqueda por clave primaria en lugar de un filtro 'where' sobre los metadatos.
+        results = await files_collection.get(ids=[file_hash])
         
         # Si la lista de IDs devuelta no está vacía, significa que el hash existe.
         return len(results["ids"]) > 0
     except Exception:
         # Si la colección no existe, es seguro decir que el hash tampoco.
-        logger.warning(f"La colección '{collection_name}' no existe aún. El hash no puede existir.")
+        logger.warning("La colección '%s' no existe aún. El hash no puede existir.", collection_name)
         return False
 
 def get_chunks_from_db(collection_name: str, limit: int = 100, offset: int = 0):
@@ -90,22 +232,23 @@ def get_chunks_from_db(collection_name: str, limit: int = 100, offset: int = 0):
         return {"error": msg}
 
     try:
-        collection = client.get_collection(name=collection_name)
-        logger.info(f"Obteniendo chunks de la colección '{collection_name}' con limit={limit} y offset={offset}.")
+        collection = _get_collection(collection_name)
+        logger.info("Obteniendo chunks de la colección '%s' con limit=%s y offset=%s.", collection_name, limit, offset)
         
         total_items = collection.count()
         results = collection.get(limit=limit, offset=offset, include=["metadatas", "documents"])
-        
-        items = [
-            {"id": id, "document": doc, "metadata": meta}
-            for id, doc, meta in zip(results["ids"], results["documents"], results["metadatas"])
-        ]
 
-        return {"collection_name": collection_name, "total_items_in_collection": total_items, "items_returned": len(items), "items": items}
+        # Se devuelven las columnas tal como las entrega ChromaDB (ids, documents, metadatas)
+        # en lugar de construir un diccionario por item.
+        return {
+            "collection_name": collection_name, "total_items_in_collection": total_items,
+            "items_returned": len(results["ids"]),
+            "ids": results["ids"], "documents": results["documents"], "metadatas": results["metadatas"]
+        }
 
     except Exception as e:
         # Captura el caso en que la colección no exista
-        logger.error(f"Error al obtener chunks de la colección '{collection_name}': {e}", exc_info=True)
+        logger.error("Error al obtener chunks de la colección '%s': %s", collection_name, e, exc_info=True)
         return {"error": f"Error al obtener chunks de la colección '{collection_name}': {e}"}
 
 def clear_collection(collection_name: str):
@@ -118,11 +261,23 @@ def clear_collection(collection_name: str):
         return False, msg
 
     try:
-        logger.warning(f"Iniciando operación de borrado para la colección: '{collection_name}'")
+        logger.warning("Iniciando operación de borrado para la colección: '%s'", collection_name)
         client.delete_collection(name=collection_name)
+        _collection_cache.pop(collection_name, None)
+        _async_collection_cache.pop(collection_name, None)
+
+        files_collection_name = _files_collection_name(collection_name)
+        try:
+            client.delete_collection(name=files_collection_name)
+        except Exception:
+            # La colección de archivos puede no existir todavía.
+            pass
+        _collection_cache.pop(files_collection_name, None)
+        _async_collection_cache.pop(files_collection_name, None)
+        _bump_files_generation(collection_name)
         
-        logger.info(f"Colección '{collection_name}' eliminada. Recreándola...")
-        client.get_or_create_collection(name=collection_name)
+        logger.info("Colección '%s' eliminada. Recreándola...", collection_name)
+        _get_collection(collection_name)
         
         msg = f"Colección '{collection_name}' limpiada y recreada exitosamente."
         logger.info(msg)
@@ -142,7 +297,7 @@ def get_chunk_by_id(collection_name: str, item_id: str):
         return {"error": msg}
 
     try:
-        collection = client.get_collection(name=collection_name)
+        collection = _get_collection(collection_name)
         # Usamos get() con el ID específico.
         # Incluimos 'embeddings' para obtener el vector completo.
         result = collection.get(
@@ -157,23 +312,23 @@ def get_chunk_by_id(collection_name: str, item_id: str):
         # Obtenemos el embedding, que es un numpy.ndarray
         embedding_vector = result["embeddings"][0]
 
-        # Re-estructuramos la respuesta, convirtiendo explícitamente el embedding a una lista de Python.
+        # Re-estructuramos la respuesta. El embedding se deja como array de numpy: la respuesta
+        # se serializa con orjson, que lo codifica directamente sin crear un float de Python por valor.
         item = {
             "id": result["ids"][0],
             "document": result["documents"][0],
             "metadata": result["metadatas"][0],
-            # El método .tolist() convierte el array de numpy en una lista estándar de Python
-            "embedding": embedding_vector.tolist() if embedding_vector is not None else None
+            "embedding": embedding_vector
         }
         return item
 
     except Exception as e:
-        logger.error(f"Error al obtener el chunk '{item_id}' de la colección '{collection_name}': {e}", exc_info=True)
+        logger.error("Error al obtener el chunk '%s' de la colección '%s': %s", item_id, collection_name, e, exc_info=True)
         return {"error": f"Error al obtener el chunk: {e}"}
 
 def get_all_chunks_by_hash(collection_name: str, file_hash: str):
     """
-    Obtiene todos los chunks (con embeddings) de un archivo específico usando su hash.
+    Obtiene todos los chunks de un archivo específico usando su hash, incluyendo sus embeddings.
     """
     if not client:
         msg = "La conexión con la base de datos no está disponible."
@@ -181,16 +336,30 @@ def get_all_chunks_by_hash(collection_name: str, file_hash: str):
         return {"error": msg}
 
     try:
-        collection = client.get_collection(name=collection_name)
+        collection = _get_collection(collection_name)
         
-        logger.info(f"Recuperando todos los chunks de la colección '{collection_name}' con hash '{file_hash}'.")
+        logger.info("Recuperando todos los chunks de la colección '%s' con hash '%s'.", collection_name, file_hash)
         
-        # CORRECCIÓN: Llamar a get() directamente con el filtro 'where'.
-        # No se cuenta primero, ya que count() no soporta filtros.
-        results = collection.get(
-            where={"file_hash": file_hash},
-            include=["metadatas", "documents", "embeddings"]
-        )
+        include = ["metadatas", "documents", "embeddings"]
+
+        # Con el número de chunks guardado en la colección de archivos podemos reconstruir
+        # los IDs y buscar por clave primaria, evitando el filtro por metadatos.
+        files_collection = _get_collection(_files_collection_name(collection_name))
+        file_entry = files_collection.get(ids=[file_hash], include=["metadatas"])
+        chunk_count = file_entry["metadatas"][0].get("chunk_count") if file_entry["ids"] else None
+
+        if chunk_count is not None:
+            results = collection.get(
+                ids=_chunk_ids(file_hash, chunk_count),
+                include=include
+            )
+        else:
+            # Archivos registrados sin número de chunks: se usa el filtro 'where'.
+            # No se cuenta primero, ya que count() no soporta filtros.
+            results = collection.get(
+                where={"file_hash": file_hash},
+                include=include
+            )
         
         if not results["ids"]:
             return [] # Devuelve una lista vacía si no se encontró nada.
@@ -201,16 +370,77 @@ def get_all_chunks_by_hash(collection_name: str, file_hash: str):
                 "id": id,
                 "document": doc,
                 "metadata": meta,
-                "embedding": emb # El embedding ya es una lista aquí, no necesita .tolist()
+                "embedding": emb # Array de numpy tal como lo devuelve ChromaDB, sin .tolist()
             }
             for id, doc, meta, emb in zip(results["ids"], results["documents"], results["metadatas"], results["embeddings"])
         ]
         return items
 
     except Exception as e:
-        logger.error(f"Error al obtener todos los chunks por hash '{file_hash}': {e}", exc_info=True)
+        logger.error("Error al obtener todos los chunks por hash '%s': %s", file_hash, e, exc_info=True)
         return {"error": f"Error al obtener chunks por hash: {e}"}
 
+# Contador de "generación" por colección: se incrementa cada vez que cambian los archivos
+# de la colección, invalidando así las entradas cacheadas del listado de archivos.
+_files_generation = collections.Counter()
+
+def _bump_files_generation(collection_name: str):
+    """Invalida el listado de archivos cacheado de una colección."""
+    _files_generation[collection_name] += 1
+
+@lru_cache(maxsize=16)
+def _get_distinct_files_cached(collection_name: str, generation: int):
+    """
+    Implementación cacheada del listado de archivos. La generación forma parte de la
+    clave, así que un cambio en la colección hace que se vuelva a consultar ChromaDB.
+    Las excepciones no se cachean.
+    """
+    # La colección auxiliar tiene una entrada por archivo, así que el listado es
+    # O(archivos) en lugar de O(chunks).
+    files_collection = _get_collection(_files_collection_name(collection_name))
+    if not files_collection.get(ids=[_FILES_BACKFILL_MARKER_ID])["ids"]:
+        _backfill_files_collection(collection_name, files_collection)
+
+    results = files_collection.get(include=["metadatas"])
+    return [
+        {"filename": meta["filename"], "file_hash": meta["file_hash"]}
+        for file_id, meta in zip(results["ids"], results["metadatas"])
+        if file_id != _FILES_BACKFILL_MARKER_ID
+    ]
+
+def _backfill_files_collection(collection_name: str, files_collection):
+    """
+    Registra en la colección auxiliar los archivos guardados antes de que existiera,
+    recorriendo una sola vez los metadatos de los chunks. Al terminar se añade una entrada
+    marcador para no repetirlo; no basta con mirar si la colección auxiliar está vacía,
+    porque un archivo subido antes del primer listado ya la llenaría.
+    """
+    logger.info("Registrando los archivos previos de la colección '%s' en la colección de archivos.", collection_name)
+    collection = _get_collection(collection_name)
+    # Obtenemos solo los metadatos para que la consulta sea ligera
+    results = collection.get(include=["metadatas"])
+
+    # Usamos un set de tuplas para obtener combinaciones únicas de nombre y hash
+    unique_files = {(meta.get("source_filename"), meta.get("file_hash")) for meta in results["metadatas"]}
+    files = {file_hash: filename for filename, file_hash in unique_files if filename and file_hash}
+
+    # Los archivos ya registrados (con su número de chunks) no se sobrescriben.
+    if files:
+        registered = set(files_collection.get(ids=list(files), include=["metadatas"])["ids"])
+        missing = [file_hash for file_hash in files if file_hash not in registered]
+        if missing:
+            files_collection.upsert(
+                ids=missing,
+                embeddings=[_FILE_ENTRY_EMBEDDING] * len(missing),
+                metadatas=[{"filename": files[file_hash], "file_hash": file_hash} for file_hash in missing]
+            )
+
+    files_collection.upsert(
+        ids=[_FILES_BACKFILL_MARKER_ID],
+        embeddings=[_FILE_ENTRY_EMBEDDING],
+        metadatas=[{"backfill_done": True}]
+    )
+
 def get_distinct_files_in_collection(collection_name: str):
     """
     Obtiene una lista de archivos únicos (nombre y hash) que han sido procesados
@@ -222,20 +452,8 @@ def get_distinct_files_in_collection(collection_name: str):
         return {"error": msg}
 
     try:
-        collection = client.get_collection(name=collection_name)
-        # Obtenemos solo los metadatos para que la consulta sea ligera
-        results = collection.get(include=["metadatas"])
-
-        if not results["ids"]:
-            return []
-
-        # Usamos un set de tuplas para obtener combinaciones únicas de nombre y hash
-        unique_files = {(meta.get("source_filename"), meta.get("file_hash")) for meta in results["metadatas"]}
-        
-        # Convertimos el set a una lista de diccionarios para la respuesta JSON
-        return [{"filename": filename, "file_hash": file_hash} for filename, file_hash in unique_files if filename and file_hash]
-        
+        return _get_distinct_files_cached(collection_name, _files_generation[collection_name])
     except Exception as e:
         # Si la colección no existe, devolvemos una lista vacía, lo cual es esperado.
-        logger.warning(f"No se pudo obtener la colección '{collection_name}' (puede que no exista aún): {e}")
+        logger.warning("No se pudo obtener la colección '%s' (puede que no exista aún): %s", collection_name, e)
         return []
@@ -1,13 +1,124 @@
-from sentence_transformers import SentenceTransformer
-from typing import List
+import asyncio
+from typing import TYPE_CHECKING, List, Optional
 import numpy as np
 
-# Carga el modelo una sola vez cuando se importa el módulo.
-# Esto es eficiente ya que evita recargar el modelo en cada llamada a la API.
+# torch y sentence-transformers se importan dentro de las funciones que los usan: su
+# importación es la mayor parte del tiempo de arranque y no hace falta para los endpoints
+# que no generan embeddings.
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# Tamaño de lote explícito para saturar las unidades de cálculo en archivos grandes.
+BATCH_SIZE = 64
+
+# Micro-batching entre peticiones concurrentes: los chunks de varias subidas se agrupan
+# en una sola llamada a encode. La cola se vacía cuando pasan MICRO_BATCH_WAIT segundos
+# desde la primera petición pendiente o cuando se acumulan MICRO_BATCH_MAX_CHUNKS chunks.
+MICRO_BATCH_WAIT = 0.02
+MICRO_BATCH_MAX_CHUNKS = 256
+
+_encode_queue: Optional[asyncio.Queue] = None
+_batcher_task: Optional[asyncio.Task] = None
+
+# El modelo se carga de forma perezosa la primera vez que se necesita, de modo que los
+# procesos que solo atienden endpoints sin embeddings (/files, /chunks, /compare) no
+# pagan la memoria ni el tiempo de carga. Después se reutiliza en todas las llamadas.
 # El modelo se descargará automáticamente la primera vez que se ejecute.
-model = SentenceTransformer('all-MiniLM-L6-v2')
+_model = None
+
+def _detect_device() -> str:
+    """Usa la GPU si está disponible y la CPU en caso contrario."""
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def _get_model() -> "SentenceTransformer":
+    """Devuelve el modelo de embeddings, cargándolo en la primera llamada."""
+    global _model
+    if _model is None:
+        from sentence_transformers import SentenceTransformer
+        device = _detect_device()
+        _model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+        if device == "cuda":
+            # En GPU se usa FP16 para reducir a la mitad el ancho de banda de memoria
+            # y aprovechar los tensor cores.
+            _model.half()
+    return _model
+
+def _encode(chunks: List[str]) -> np.ndarray:
+    """
+    Codifica una lista de chunks con el modelo y devuelve un array float32 normalizado.
+    """
+    model = _get_model()
+    if not chunks:
+        return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
 
-def get_embeddings(chunks: List[str]) -> List[List[float]]:
+    # Se devuelve el array de numpy directamente, sin convertirlo a listas de Python,
+    # para que ChromaDB reciba un buffer contiguo en lugar de un float por objeto.
+    embeddings = model.encode(
+        chunks,
+        batch_size=BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+    return embeddings.astype(np.float32, copy=False)
+
+async def _batcher():
+    """
+    Tarea de fondo que agrupa las peticiones pendientes de la cola, las codifica en una
+    sola llamada al modelo y reparte el resultado entre quienes esperan.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        pending = [await _encode_queue.get()]
+        total_chunks = len(pending[0][0])
+        deadline = loop.time() + MICRO_BATCH_WAIT
+        while total_chunks < MICRO_BATCH_MAX_CHUNKS:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_encode_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            pending.append(item)
+            total_chunks += len(item[0])
+
+        all_chunks = [chunk for chunks, _ in pending for chunk in chunks]
+        try:
+            # El modelo se ejecuta en un hilo para no bloquear el event loop.
+            embeddings = await asyncio.to_thread(_encode, all_chunks)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        offset = 0
+        for chunks, future in pending:
+            if not future.done():
+                future.set_result(embeddings[offset:offset + len(chunks)])
+            offset += len(chunks)
+
+async def start_encode_batcher():
+    """Crea la cola de micro-batching y arranca la tarea de fondo que la atiende."""
+    global _encode_queue, _batcher_task
+    _encode_queue = asyncio.Queue()
+    _batcher_task = asyncio.create_task(_batcher())
+
+async def stop_encode_batcher():
+    """Detiene la tarea de micro-batching."""
+    global _encode_queue, _batcher_task
+    if _batcher_task is not None:
+        _batcher_task.cancel()
+        try:
+            await _batcher_task
+        except asyncio.CancelledError:
+            pass
+    _encode_queue = None
+    _batcher_task = None
+
+async def get_embeddings(chunks: List[str]) -> np.ndarray:
     """
     Genera embeddings para una lista de fragmentos de texto.
 
@@ -15,11 +126,13 @@ def get_embeddings(chunks: List[str]) -> List[List[float]]:
         chunks: Una lista de strings (fragmentos de texto).
 
     Returns:
-        Una lista de vectores de embedding, donde cada vector es una lista de floats.
+        Un array de numpy float32 de forma (len(chunks), dimensión), con un embedding
+        normalizado (norma L2 = 1) por fila.
     """
-    if not chunks:
-        return []
-        
-    # El método encode devuelve un array de numpy, lo convertimos a lista para que sea serializable en JSON.
-    embeddings = model.encode(chunks, convert_to_tensor=False)
-    return embeddings.tolist()
+    if not chunks or _encode_queue is None:
+        # Sin la cola de micro-batching (p. ej. fuera de la aplicación FastAPI) se codifica directamente.
+        return await asyncio.to_thread(_encode, chunks)
+
+    future = asyncio.get_running_loop().create_future()
+    await _encode_queue.put((chunks, future))
+    return await future
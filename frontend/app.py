@@ -12,12 +12,27 @@ st.set_page_config(page_title="Conciliador de Archivos", layout="wide")
 # Obtener la URL de la API desde las variables de entorno (configurado en docker-compose)
 API_URL = os.getenv("API_URL", "http://localhost:8000")
 
+@st.cache_resource
+def get_http_session():
+    """
+    Crea una sesión HTTP compartida con keep-alive y pool de conexiones.
+    Se cachea con st.cache_resource para que sobreviva a los reruns de Streamlit
+    y no se abra una conexión nueva en cada llamada a la API.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+SESSION = get_http_session()
+
 # --- Funciones de Interacción con la API ---
 
 def get_files_from_collection(collection_name):
     """Obtiene la lista de archivos de una colección desde la API."""
     try:
-        response = requests.get(f"{API_URL}/files/{collection_name}")
+        response = SESSION.get(f"{API_URL}/files/{collection_name}")
         response.raise_for_status()
         return response.json().get("files", [])
     except requests.exceptions.RequestException as e:
@@ -38,7 +53,7 @@ def upload_file(collection_name, uploaded_file):
     files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
     try:
         with st.spinner(f"Procesando '{uploaded_file.name}'... Esto puede tardar unos segundos."):
-            response = requests.post(f"{API_URL}/process-file/{collection_name}", files=files)
+            response = SESSION.post(f"{API_URL}/process-file/{collection_name}", files=files)
         
         if response.status_code == 409: # Conflict
             st.warning(f"El contenido del archivo '{uploaded_file.name}' ya ha sido procesado anteriormente en esta colección.")
@@ -59,7 +74,7 @@ def match_files(bank_hash, fm_hash, threshold):
     }
     try:
         with st.spinner("Realizando conciliación... Este proceso puede ser largo dependiendo del tamaño de los archivos."):
-            response = requests.post(f"{API_URL}/match-files?min_score_threshold={threshold}", json=payload)
+            response = SESSION.post(f"{API_URL}/match-files?min_score_threshold={threshold}", json=payload)
             response.raise_for_status()
         st.success("¡Conciliación completada!")
         return response.json().get("match_results", [])
@@ -1,10 +1,24 @@
 import logging
+import os
 import sys
 
+# Nivel de log configurable mediante la variable de entorno LOG_LEVEL (por defecto INFO).
+# En producción puede subirse a WARNING para omitir el formateo de los mensajes informativos.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
 # Configurar el logger
 # Esto crea un logger llamado "row_match_logger"
 logger = logging.getLogger("row_match_logger")
-logger.setLevel(logging.DEBUG)  # Captura todos los niveles de logs
+
+# Un valor desconocido (p. ej. LOG_LEVEL=verbose) haría fallar setLevel al importar el
+# módulo y la API no arrancaría, así que se valida y se usa INFO en su lugar.
+# (logging.getLevelNamesMapping() requiere Python 3.11; la imagen usa 3.10, donde
+# getLevelName devuelve el número del nivel solo si el nombre es conocido.)
+_requested_log_level = LOG_LEVEL
+_log_level_is_valid = isinstance(logging.getLevelName(LOG_LEVEL), int)
+if not _log_level_is_valid:
+    LOG_LEVEL = "INFO"
+logger.setLevel(LOG_LEVEL)
 
 # Crear un manejador (handler) para dirigir los logs a la salida estándar (consola)
 # Esto es ideal para ver los logs de Docker con `docker-compose logs`
@@ -22,3 +36,6 @@ handler.setFormatter(formatter)
 # Evita añadir handlers duplicados si este módulo se recarga
 if not logger.handlers:
     logger.addHandler(handler)
+
+if not _log_level_is_valid:
+    logger.warning("LOG_LEVEL '%s' no es un nivel de log válido; se usará INFO.", _requested_log_level)
@@ -1,7 +1,15 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
+# ORJSONResponse de FastAPI serializa con orjson y codifica arrays de numpy de forma
+# nativa (OPT_SERIALIZE_NUMPY), sin convertirlos antes a listas de Python.
+from fastapi.responses import ORJSONResponse
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Dict, Any
 from enum import Enum
-import hashlib
+import blake3
+import numpy as np
 from pydantic import BaseModel
 
 # Importa la lógica de los otros módulos
@@ -9,6 +17,7 @@ import processing
 import embeddings
 from logging_config import logger
 from database import (
+    connect_async_client,
     save_chunks_to_db, 
     get_chunks_from_db, 
     clear_collection, 
@@ -17,7 +26,19 @@ from database import (
     get_all_chunks_by_hash,
     get_distinct_files_in_collection # <-- Importar la nueva función
 )
-from similarity import calculate_cosine_similarity, calculate_structural_similarity
+from similarity import (
+    calculate_cosine_similarity,
+    calculate_cosine_similarity_batch,
+    calculate_structural_similarity,
+    has_structural_codes,
+)
+
+# Tamaño de los bloques en los que se lee un archivo subido (1 MiB).
+UPLOAD_READ_SIZE = 1 << 20
+
+# El contenido de los archivos se identifica con un hash BLAKE3 truncado a 128 bits
+# (32 caracteres hexadecimales).
+FILE_HASH_BYTES = 16
 
 # --- Modelos de Datos para Validación ---
 
@@ -39,12 +60,61 @@ class MatchFilesRequest(BaseModel):
     bank_movements_hash: str
     fm_report_hash: str
 
+# --- Funciones auxiliares de matching ---
+
+# Dos similitudes de coseno que difieren en menos de esto se consideran empatadas. La
+# matriz se calcula en float32, cuyo redondeo puede invertir el orden de dos chunks con
+# puntuaciones (casi) iguales; ante un empate se elige siempre el de menor índice.
+COSINE_TIE_TOLERANCE = 1e-6
+
+def _find_best_match(bank_document: str, bank_has_codes: bool, cosine_row: np.ndarray,
+                     fm_documents: list, fm_has_codes: np.ndarray, min_digits: int) -> tuple:
+    """
+    Devuelve (índice, similitud estructural) del mejor chunk de FM para un movimiento bancario.
+
+    La similitud estructural es 0 o 1 y pesa 0.7, así que cualquier candidato con
+    coincidencia estructural supera a todos los demás. Recorremos los candidatos en
+    orden de coseno descendente y nos quedamos con el primero que coincida. Solo se
+    comparan los chunks que pueden coincidir estructuralmente (ver has_structural_codes).
+    Entre candidatos empatados (ver COSINE_TIE_TOLERANCE) gana el de menor índice.
+    """
+    if bank_has_codes:
+        candidates = np.argsort(-cosine_row, kind="stable")
+        best = None
+        for j in candidates[fm_has_codes[candidates]]:
+            # Tras el primer acierto solo se siguen mirando los candidatos empatados con él.
+            if best is not None and cosine_row[j] < best_cosine - COSINE_TIE_TOLERANCE:
+                break
+            if calculate_structural_similarity(bank_document, fm_documents[j], min_digits) > 0:
+                if best is None:
+                    best, best_cosine = j, cosine_row[j]
+                else:
+                    best = min(best, j)
+        if best is not None:
+            return int(best), 1.0
+    threshold = cosine_row.max() - COSINE_TIE_TOLERANCE
+    return int(np.flatnonzero(cosine_row >= threshold)[0]), 0.0
+
 # --- Aplicación FastAPI ---
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El cliente asíncrono de ChromaDB se crea una sola vez al arrancar la aplicación.
+    await connect_async_client()
+    # La cola de micro-batching agrupa los embeddings de subidas concurrentes.
+    await embeddings.start_encode_batcher()
+    # Pool de procesos para extraer PDFs grandes, compartido por todas las peticiones.
+    processing.start_pdf_pool()
+    yield
+    processing.shutdown_pdf_pool()
+    await embeddings.stop_encode_batcher()
+
 app = FastAPI(
     title="API para Procesamiento de Archivos y Generación de Embeddings",
     description="Sube, explora, compara y haz matching de archivos a través de embeddings vectoriales.",
     version="1.5.0", # Versión incrementada
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 @app.post("/process-file/{collection_name}", 
@@ -52,23 +122,34 @@ app = FastAPI(
           responses={409: {"description": "El archivo ya ha sido procesado."}})
 async def create_embeddings_from_file(collection_name: CollectionName, file: UploadFile = File(...)):
     filename = file.filename if file.filename else "unknown_file"
-    logger.info(f"Recibida petición para procesar '{filename}' en la colección '{collection_name.value}'")
+    logger.info("Recibida petición para procesar '%s' en la colección '%s'", filename, collection_name.value)
     
+    # Leemos el archivo por bloques y calculamos el hash a medida que llegan, en un hilo
+    # aparte para no bloquear el event loop mientras se procesan otras peticiones.
+    hasher = blake3.blake3()
+    buffer = bytearray()
     try:
-        file_content = await file.read()
+        while block := await file.read(UPLOAD_READ_SIZE):
+            await asyncio.to_thread(hasher.update, block)
+            buffer += block
     finally:
         await file.close()
 
-    file_hash = hashlib.sha256(file_content).hexdigest()
-    if check_if_hash_exists(collection_name.value, file_hash):
+    file_content = bytes(buffer)
+    del buffer
+    file_hash = hasher.hexdigest(FILE_HASH_BYTES)
+    if await check_if_hash_exists(collection_name.value, file_hash):
         raise HTTPException(status_code=409, detail=f"Este contenido de archivo ya existe en la colección '{collection_name.value}'.")
 
-    chunks = processing.extract_chunks_from_file(file_content, filename)
+    # La extracción (PDF, OCR, Excel) es trabajo de CPU: se ejecuta en un hilo para no
+    # bloquear el event loop y para que varias subidas se procesen a la vez (p. ej. el
+    # OCR de varias imágenes con el pool de instancias de tesserocr).
+    chunks = await asyncio.to_thread(processing.extract_chunks_from_file, file_content, filename, file_hash)
     if not chunks:
         raise HTTPException(status_code=404, detail="No se pudo extraer contenido del archivo.")
     
-    chunk_embeddings = embeddings.get_embeddings(chunks)
-    num_saved = save_chunks_to_db(collection_name.value, filename, file_hash, chunks, chunk_embeddings)
+    chunk_embeddings = await embeddings.get_embeddings(chunks)
+    num_saved = await save_chunks_to_db(collection_name.value, filename, file_hash, chunks, chunk_embeddings)
 
     return {
         "collection": collection_name.value,
@@ -82,7 +163,7 @@ async def create_embeddings_from_file(collection_name: CollectionName, file: Upl
 @app.post("/match-files",
           summary="Realiza un matching entre un archivo de movimientos bancarios y un reporte de FM")
 def match_files(request: MatchFilesRequest, min_score_threshold: float = 0.8, min_digits: int = 5):
-    logger.info(f"Iniciando proceso de matching con umbral de score >= {min_score_threshold}")
+    logger.info("Iniciando proceso de matching con umbral de score >= %s", min_score_threshold)
     bank_chunks = get_all_chunks_by_hash(CollectionName.bank_movements.value, request.bank_movements_hash)
     fm_chunks = get_all_chunks_by_hash(CollectionName.fm_report.value, request.fm_report_hash)
 
@@ -91,23 +172,40 @@ def match_files(request: MatchFilesRequest, min_score_threshold: float = 0.8, mi
     if isinstance(fm_chunks, dict) and "error" in fm_chunks or not fm_chunks:
         raise HTTPException(status_code=404, detail=f"No se encontraron chunks para el hash del reporte FM: {request.fm_report_hash}")
 
+    # Matriz de similitud de coseno completa (N x M). Los embeddings guardados ya
+    # normalizados (metadato "normalized") no necesitan volver a normalizarse.
+    bank_emb = np.asarray([c["embedding"] for c in bank_chunks], dtype=np.float32)
+    fm_emb = np.asarray([c["embedding"] for c in fm_chunks], dtype=np.float32)
+    all_normalized = all(c["metadata"].get("normalized") for c in bank_chunks + fm_chunks)
+    cosine_matrix = calculate_cosine_similarity_batch(bank_emb, fm_emb, normalized=all_normalized)
+
+    # Cada movimiento bancario se empareja de forma independiente, así que se reparten
+    # entre un pool de hilos (las operaciones de numpy liberan el GIL).
+    fm_documents = [c["document"] for c in fm_chunks]
+    # Se precalcula una sola vez por chunk qué textos pueden tener coincidencia estructural,
+    # en lugar de descubrirlo en cada comparación par a par.
+    bank_has_codes = [has_structural_codes(c["document"], min_digits) for c in bank_chunks]
+    fm_has_codes = np.array([has_structural_codes(doc, min_digits) for doc in fm_documents], dtype=bool)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        best_matches = list(executor.map(
+            lambda i: _find_best_match(bank_chunks[i]["document"], bank_has_codes[i], cosine_matrix[i],
+                                       fm_documents, fm_has_codes, min_digits),
+            range(len(bank_chunks))
+        ))
+
     match_results = []
-    for bank_chunk in bank_chunks:
-        best_match = {"fm_chunk_id": None, "combined_score": -1.0}
-        for fm_chunk in fm_chunks:
-            cosine_sim = calculate_cosine_similarity(bank_chunk["embedding"], fm_chunk["embedding"])
-            struct_sim = calculate_structural_similarity(bank_chunk["document"], fm_chunk["document"], min_digits)
-            combined_score = (0.7 * struct_sim) + (0.3 * cosine_sim)
-            if combined_score > best_match["combined_score"]:
-                best_match = {
+    for bank_chunk, cosine_row, (best_j, struct_sim) in zip(bank_chunks, cosine_matrix, best_matches):
+        cosine_sim = float(cosine_row[best_j])
+        combined_score = (0.7 * struct_sim) + (0.3 * cosine_sim)
+        if combined_score >= min_score_threshold:
+            fm_chunk = fm_chunks[best_j]
+            match_results.append({
+                "bank_movement_chunk": {"id": bank_chunk["id"], "document": bank_chunk["document"]},
+                "best_match_in_fm_report": {
                     "fm_chunk_id": fm_chunk["id"], "combined_score": combined_score,
                     "cosine_similarity": cosine_sim, "structural_similarity": struct_sim,
                     "fm_chunk_document": fm_chunk["document"]
                 }
-        if best_match["combined_score"] >= min_score_threshold:
-            match_results.append({
-                "bank_movement_chunk": {"id": bank_chunk["id"], "document": bank_chunk["document"]},
-                "best_match_in_fm_report": best_match
             })
     return {"match_results": match_results}
 
@@ -118,7 +216,7 @@ def list_files_in_collection(collection_name: CollectionName):
     Devuelve una lista de archivos únicos (nombre y hash) que han sido
     procesados y guardados en la colección especificada.
     """
-    logger.info(f"Recibida petición para listar archivos en la colección '{collection_name.value}'.")
+    logger.info("Recibida petición para listar archivos en la colección '%s'.", collection_name.value)
     files = get_distinct_files_in_collection(collection_name.value)
     if isinstance(files, dict) and "error" in files:
         raise HTTPException(status_code=500, detail=files["error"])
@@ -132,7 +230,8 @@ def compare_two_chunks(request: ComparisonRequest):
     item2_data = get_chunk_by_id(request.item2.collection_name.value, request.item2.item_id)
     if not item2_data or "error" in item2_data:
         raise HTTPException(status_code=404, detail=f"Item 2 con ID '{request.item2.item_id}' no encontrado.")
-    cosine_score = calculate_cosine_similarity(item1_data.get("embedding"), item2_data.get("embedding"))
+    both_normalized = bool(item1_data["metadata"].get("normalized") and item2_data["metadata"].get("normalized"))
+    cosine_score = calculate_cosine_similarity(item1_data.get("embedding"), item2_data.get("embedding"), normalized=both_normalized)
     structural_score = calculate_structural_similarity(item1_data.get("document", ""), item2_data.get("document", ""), request.min_digits)
     return {
         "cosine_similarity": cosine_score, "structural_similarity": structural_score,
@@ -147,7 +246,9 @@ def get_single_chunk(collection_name: CollectionName, item_id: str):
         raise HTTPException(status_code=404, detail=f"Chunk con ID '{item_id}' no encontrado.")
     if "error" in item:
         raise HTTPException(status_code=500, detail=item["error"])
-    return item
+    # Se devuelve la respuesta directamente para que orjson serialice el embedding (numpy)
+    # sin pasar por jsonable_encoder de FastAPI, que no admite arrays de numpy.
+    return ORJSONResponse(item)
 
 @app.get("/chunks/{collection_name}", summary="Explora los chunks de una colección específica")
 def get_stored_chunks(collection_name: CollectionName, limit: int = 100, offset: int = 0):
@@ -1,8 +1,19 @@
 import io
+import logging
+import multiprocessing
+import os
 import pathlib
+import queue
 import re
-from typing import List, Tuple
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
+import cv2
+import numpy as np
 import pandas as pd
 import pytesseract
 from PIL import Image
@@ -12,6 +23,72 @@ from logging_config import logger
 
 # --- Funciones para identificar y validar movimientos bancarios ---
 
+# --- Patrones precompilados para is_institutional_info ---
+# Se construyen una sola vez al importar el módulo en lugar de en cada línea evaluada.
+
+# Palabras clave institucionales comunes
+_INSTITUTIONAL_KEYWORDS = [
+    "banco", "universal", "capital", "autorizado", "suscrito", "pagado",
+    "rif", "j-", "apartado", "postal", "c.a.", "s.a.", "compañía anónima",
+    "dirección", "teléfono", "atención", "horario", "sucursal", "oficina",
+    "casa matriz", "sede principal", "central", "contacto", "servicio al cliente",
+    "banesco", "estado de cuenta", "resumen de movimientos", "resumen de saldos",
+    "expansión monetaria", "república bolivariana", "monetario nacional",
+    "detalle de movimientos", "cheques", "otros débitos", "otros créditos",
+    "bbva provincial", "titular", "nro. de cuenta", "situación al", "detalle de movimientos",
+    "f. oper", "ref.", "concepto", "f. valor", "cargos", "abonos", "saldo",
+    "saldo anterior", "expresión monetaria", "bolivares", "bolívares", "línea provincial",
+    "confirmar", "validar", "copia de estado", "número de confirmación"
+]
+
+# Patrones específicos de información institucional, unidos en una sola alternancia.
+# Como las demás expresiones de palabras de is_bank_transaction, se escriben en minúsculas
+# y se aplican sin IGNORECASE a la línea ya pasada a minúsculas, que se calcula una sola vez:
+# así el motor de regex compara caracteres directamente en lugar de plegar mayúsculas en
+# cada intento.
+_INSTITUTIONAL_RE = re.compile("|".join(f"(?:{pattern})" for pattern in [
+    r'banco\s+\w+',  # Nombre de banco (Banco Provincial, Banco de Venezuela, etc.)
+    r'capital\s+(autorizado|suscrito|pagado)',  # Información de capital
+    r'rif\.?\s*[a-z]-\d+',  # Formato de RIF
+    r'apartado\s+postal',  # Apartado postal
+    r'[a-z]\.?[a-z]\.?,?\s*banco',  # Formatos como C.A. Banco, S.A. Banco
+    r'bs\.?\s*[\d.,]+',  # Cantidades en Bs. (típico en información institucional)
+    r'estado\s+de\s+cuenta',  # Título del estado de cuenta
+    r'resumen\s+de\s+(movimientos|saldos)',  # Secciones de resumen
+    r'detalle\s+de\s+movimientos',  # Sección de detalle
+    r'(concepto|monto\s+total)',  # Encabezados de tabla
+    r'(otros\s+(débitos|créditos)|cheques)',  # Categorías de movimientos
+    r'(no\.\s+de\s+cuenta|fecha)',  # Información de cuenta y fecha
+    r'titular\s*:',  # Titular de la cuenta
+    r'situaci[óo]n\s+al\s*:',  # Fecha de situación
+    r'nro\.\s+de\s+cuenta\s*:',  # Número de cuenta
+    r'f\.\s+oper',  # Fecha de operación
+    r'f\.\s+valor',  # Fecha valor
+    r'saldo\s+anterior',  # Saldo anterior
+    r'bbva\s+provincial',  # Nombre del banco BBVA
+    r'puede\s+validar',  # Texto de validación
+    r'n[uú]mero\s+de\s+confirmaci[oó]n',  # Número de confirmación
+    r'expresi[oó]n\s+monetaria',  # Información sobre expresión monetaria
+    r'bol[ií]vares\s+anteriores',  # Información sobre bolívares
+]))
+
+# Elementos típicos de información institucional (basta con uno)
+_INSTITUTIONAL_ELEMENTS_RE = re.compile("|".join(f"(?:{pattern})" for pattern in [
+    r'\d{4}-[a-z]',  # Códigos postales (ej. 1010-A)
+    r'www\.',  # URLs
+    r'@',  # Correos electrónicos
+    r'tel[éf]fono',  # Menciones a teléfonos
+    r'fax',  # Menciones a fax
+    r'direcci[óo]n',  # Menciones a dirección
+    r'caracas',  # Menciones a ciudades principales
+    r'venezuela',  # Menciones al país
+]))
+
+# Los estados de cuenta repiten muchas líneas (encabezados en cada página, "saldo anterior",
+# etc.), así que las funciones de clasificación de líneas recuerdan sus últimos resultados.
+LINE_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=LINE_CACHE_SIZE)
 def is_institutional_info(line: str) -> bool:
     """
     Determina si una línea contiene información institucional de un banco.
@@ -23,80 +100,171 @@ def is_institutional_info(line: str) -> bool:
         True si la línea parece ser información institucional, False en caso contrario
     """
     line_lower = line.lower()
-    
+    keyword_count, _ = _scan_keywords(line_lower)
+    return _is_institutional_info(line_lower, keyword_count)
+
+def _is_institutional_info(line_lower: str, keyword_count: int) -> bool:
+    """
+    Implementación de is_institutional_info que recibe la línea ya en minúsculas y ya
+    contado el número de palabras clave institucionales (ver _scan_keywords), para que
+    is_bank_transaction pueda obtenerlo en la misma pasada que las palabras clave de encabezado.
+    """
     # 1. Verificar palabras clave institucionales comunes
-    institutional_keywords = [
-        "banco", "universal", "capital", "autorizado", "suscrito", "pagado",
-        "rif", "j-", "apartado", "postal", "c.a.", "s.a.", "compañía anónima",
-        "dirección", "teléfono", "atención", "horario", "sucursal", "oficina",
-        "casa matriz", "sede principal", "central", "contacto", "servicio al cliente",
-        "banesco", "estado de cuenta", "resumen de movimientos", "resumen de saldos",
-        "expansión monetaria", "república bolivariana", "monetario nacional",
-        "detalle de movimientos", "cheques", "otros débitos", "otros créditos",
-        "bbva provincial", "titular", "nro. de cuenta", "situación al", "detalle de movimientos",
-        "f. oper", "ref.", "concepto", "f. valor", "cargos", "abonos", "saldo",
-        "saldo anterior", "expresión monetaria", "bolivares", "bolívares", "línea provincial",
-        "confirmar", "validar", "copia de estado", "número de confirmación"
-    ]
-    
-    keyword_count = sum(1 for keyword in institutional_keywords if keyword in line_lower)
     if keyword_count >= 2:  # Si hay 2 o más palabras clave institucionales
         return True
     
     # 2. Verificar patrones específicos de información institucional
-    institutional_patterns = [
-        r'(?i)banco\s+\w+',  # Nombre de banco (Banco Provincial, Banco de Venezuela, etc.)
-        r'(?i)capital\s+(autorizado|suscrito|pagado)',  # Información de capital
-        r'(?i)rif\.?\s*[a-z]-\d+',  # Formato de RIF
-        r'(?i)apartado\s+postal',  # Apartado postal
-        r'(?i)[a-z]\.?[a-z]\.?,?\s*banco',  # Formatos como C.A. Banco, S.A. Banco
-        r'(?i)bs\.?\s*[\d.,]+',  # Cantidades en Bs. (típico en información institucional)
-        r'(?i)estado\s+de\s+cuenta',  # Título del estado de cuenta
-        r'(?i)resumen\s+de\s+(movimientos|saldos)',  # Secciones de resumen
-        r'(?i)detalle\s+de\s+movimientos',  # Sección de detalle
-        r'(?i)(concepto|monto\s+total)',  # Encabezados de tabla
-        r'(?i)(otros\s+(débitos|créditos)|cheques)',  # Categorías de movimientos
-        r'(?i)(no\.\s+de\s+cuenta|fecha)',  # Información de cuenta y fecha
-        r'(?i)titular\s*:',  # Titular de la cuenta
-        r'(?i)situaci[óo]n\s+al\s*:',  # Fecha de situación
-        r'(?i)nro\.\s+de\s+cuenta\s*:',  # Número de cuenta
-        r'(?i)f\.\s+oper',  # Fecha de operación
-        r'(?i)f\.\s+valor',  # Fecha valor
-        r'(?i)saldo\s+anterior',  # Saldo anterior
-        r'(?i)bbva\s+provincial',  # Nombre del banco BBVA
-        r'(?i)puede\s+validar',  # Texto de validación
-        r'(?i)n[uú]mero\s+de\s+confirmaci[oó]n',  # Número de confirmación
-        r'(?i)expresi[oó]n\s+monetaria',  # Información sobre expresión monetaria
-        r'(?i)bol[ií]vares\s+anteriores',  # Información sobre bolívares
-    ]
-    
-    for pattern in institutional_patterns:
-        if re.search(pattern, line):
-            return True
-    
-    # 3. Verificar si contiene múltiples elementos típicos de información institucional
-    elements = [
-        r'(?i)\d{4}-[a-z]',  # Códigos postales (ej. 1010-A)
-        r'(?i)www\.',  # URLs
-        r'(?i)@',  # Correos electrónicos
-        r'(?i)tel[éf]fono',  # Menciones a teléfonos
-        r'(?i)fax',  # Menciones a fax
-        r'(?i)direcci[óo]n',  # Menciones a dirección
-        r'(?i)caracas',  # Menciones a ciudades principales
-        r'(?i)venezuela',  # Menciones al país
-    ]
-    
-    element_count = sum(1 for pattern in elements if re.search(pattern, line))
-    if element_count >= 1:  # Si hay al menos un elemento institucional
+    if _INSTITUTIONAL_RE.search(line_lower):
+        return True
+    
+    # 3. Verificar si contiene elementos típicos de información institucional
+    if _INSTITUTIONAL_ELEMENTS_RE.search(line_lower):
         return True
     
     # 4. Verificar longitud y estructura
     # Información institucional suele ser más larga y contener muchas comas
-    if len(line) > 100 and line.count(',') >= 3:
+    if len(line_lower) > 100 and line_lower.count(',') >= 3:
         return True
     
     return False
 
+# --- Patrones precompilados para is_bank_transaction y extract_transaction_data ---
+# Se compilan una sola vez al importar el módulo en lugar de en cada línea procesada.
+
+# Palabras clave típicas de encabezados o información no relevante. Se buscan como
+# una única alternancia sobre la línea en minúsculas.
+_HEADER_KEYWORDS = [
+    "página", "page", "fecha de emisión", "rif", "cliente", "cuenta", 
+    "dirección", "teléfono", "saldo anterior", "total", "subtotal", 
+    "www.", ".com", "http", "consulta", "resumen", "estado de cuenta",
+    "capital autorizado", "capital suscrito", "apartado postal", "mercantil",
+    "banco universal", "correo", "centro de atención", "contacto", "atención",
+    "digitaliza", "actualiza", "impuesto", "resumen estado", "código cliente",
+    "saldo al inicio", "saldo al final", "período", "cheques", "depósitos",
+    "débitos", "créditos", "oficina", "sucursal", "movimientos de cuenta"
+]
+_HEADER_RE = re.compile("|".join(map(re.escape, _HEADER_KEYWORDS)))
+
+# Si pyahocorasick está instalado, las palabras clave institucionales y las de encabezado
+# se buscan con un único autómata Aho-Corasick: una sola pasada lineal sobre la línea
+# para todas las palabras de ambas listas a la vez. Si no, se usa el recorrido de la lista
+# institucional y la alternancia compilada de encabezados.
+try:
+    import ahocorasick
+
+    _KEYWORD_AUTOMATON = ahocorasick.Automaton()
+    for _keyword in set(_INSTITUTIONAL_KEYWORDS) | set(_HEADER_KEYWORDS):
+        # Valor: (palabra, veces que aparece en la lista institucional, si es de encabezado).
+        # Una palabra repetida en la lista institucional cuenta tantas veces como aparece.
+        _KEYWORD_AUTOMATON.add_word(_keyword, (
+            _keyword, _INSTITUTIONAL_KEYWORDS.count(_keyword), _keyword in _HEADER_KEYWORDS,
+        ))
+    _KEYWORD_AUTOMATON.make_automaton()
+except ImportError:
+    _KEYWORD_AUTOMATON = None
+
+def _scan_keywords(line_lower: str) -> Tuple[int, bool]:
+    """
+    Recorre la línea (en minúsculas) una sola vez y devuelve cuántas palabras clave
+    institucionales distintas contiene y si contiene alguna palabra clave de encabezado.
+    """
+    if _KEYWORD_AUTOMATON is None:
+        institutional_count = sum(1 for keyword in _INSTITUTIONAL_KEYWORDS if keyword in line_lower)
+        return institutional_count, _HEADER_RE.search(line_lower) is not None
+
+    institutional_count = 0
+    has_header = False
+    seen = set()
+    for _, (keyword, weight, is_header) in _KEYWORD_AUTOMATON.iter(line_lower):
+        if keyword not in seen:
+            seen.add(keyword)
+            institutional_count += weight
+            has_header = has_header or is_header
+    return institutional_count, has_header
+
+# Encabezados de tabla o de pie de página que ocupan toda la línea
+_TABLE_HEADER_RE = re.compile(r'^(fecha|descripción|referencia|monto|importe|saldo|débito|crédito|concepto)$')
+
+# Caracteres especiales poco habituales en un movimiento bancario. Se cuentan con findall
+# sobre una clase de caracteres, un único recorrido en C de la línea.
+_SPECIAL_CHARS_RE = re.compile('[' + re.escape('@#$%^&*()_+=[]{}|\\:;"\'<>?') + ']')
+
+# Información de contacto o direcciones
+_CONTACT_RE = re.compile(r'(tel[éf]fono|fax|correo|e-mail|@|www\.|http|https)')
+
+# Las expresiones de fecha y monto solo se usan para saber si la línea contiene una fecha
+# y un monto, no para extraerlos. Por eso cada una se reduce a la forma más simple que
+# coincide exactamente en las mismas líneas: se omiten las variantes que ya están
+# contenidas en otra alternativa.
+
+# Fecha típica de transacciones bancarias: DD/MM, DD/MM/YY, DD/MM/YYYY, YYYY/MM/DD o
+# YY/MM/DD. Todas contienen un DD/MM (o MM/DD), que basta para detectarlas.
+_DATE_RE = re.compile(r'\d{1,2}[-/]\d{1,2}')
+
+# Monto con formato de moneda: números que pueden tener separador de miles (.) y decimal (,).
+# Cualquier monto con formato estricto (1.234,56 o 1234,56) coincide también con el patrón
+# simple de respaldo, así que solo se busca este.
+_AMOUNT_RE = re.compile(r'[\d.,]+\d{2}')
+
+# Referencias comunes en movimientos bancarios: secuencia de 5+ dígitos, alfanumérico de
+# 5+ caracteres o palabras clave seguidas de identificadores
+_REF_RE = re.compile(r'\d{5,}|[A-Z0-9]{5,}|(?:REF|TRX|ID)[:\s]*\w+', re.IGNORECASE)
+
+# Las tres condiciones anteriores (fecha, monto y referencia) en una sola expresión: un
+# lookahead por condición desde el inicio de la línea. Equivale a las tres búsquedas por
+# separado, pero con una sola llamada al motor de regex por línea.
+_DATE_AMOUNT_REF_RE = re.compile(
+    rf'\A(?=.*?(?:{_DATE_RE.pattern}))(?=.*?(?:{_AMOUNT_RE.pattern}))(?=.*?(?i:{_REF_RE.pattern}))',
+    re.DOTALL,
+)
+
+# Patrones específicos para identificar líneas que NO son transacciones, unidos en una
+# sola alternancia (basta con que coincida uno)
+_NON_TRANSACTION_RE = re.compile("|".join(f"(?:{pattern})" for pattern in [
+    r'rif\.?\s*[a-z]-\d+',  # Patrón de RIF (Registro de Información Fiscal)
+    r'apartado\s+postal',   # Menciones a apartado postal
+    r'capital\s+(autorizado|suscrito|pagado)',  # Información de capital del banco
+    r'bs\.?\s*[\d.,]+',     # Mención de cantidades con Bs. (típico en información institucional)
+    r'mercantil.*banco\s+universal',  # Nombre del banco con su designación
+    r'caracas\s+\d+',       # Menciones a direcciones con códigos postales
+    r'venezuela',           # Mención al país
+    r'c\.?a\.?,?\s*banco',  # Formato de compañía anónima bancaria
+    r'^\s*cuenta\s+\d+\s*$',    # Solo número de cuenta en la línea
+    r'^(banco|oficina|sucursal)\s*$',  # Encabezados simples
+    r'^(desde|hasta)\s*$',   # Palabras sueltas de encabezados
+    r'nro\.?\s*\d+'         # Número de referencia institucional (no transaccional)
+]))
+
+# Palabras clave institucionales que, si aparecen 3 o más juntas, descartan la línea
+_TRANSACTION_INSTITUTIONAL_KEYWORDS = [
+    "capital", "autorizado", "suscrito", "pagado", "rif", "j-", "apartado",
+    "postal", "caracas", "venezuela", "mercantil", "banco universal"
+]
+
+# Estructura de movimiento bancario:
+# fecha (DD/MM) + número de referencia + descripción + monto, o
+# fecha al inicio y montos al final
+_TRANSACTION_RE = re.compile(
+    r'\d{1,2}[-/]\d{1,2}.*?\d{5,}.*?[\d.,]+\d{2}'
+    r'|\d{1,2}[-/]\d{1,2}.*?[\d.,]+\d{2}.*?[\d.,]+\d{2}'
+)
+
+# Fecha seguida de número de referencia
+_DATE_REF_RE = re.compile(r'\d{1,2}[-/]\d{1,2}.*?\d{5,}')
+
+# Características de información general (no transaccional)
+_GENERAL_INFO_RE = re.compile(r'(capital|rif|apartado|banco universal|autorizado|mercantil|c\.a\.|venezuela)')
+
+# Mínimo de dígitos de una línea que cumpla _TRANSACTION_RE o _DATE_REF_RE: fecha (2)
+# + monto (2) + monto (2), o fecha (2) + referencia (5).
+_MIN_TRANSACTION_DIGITS = 6
+
+# Componentes de un movimiento para extract_transaction_data
+_TXN_DATE_RE = re.compile(r'\d{2}[-/]\d{2}[-/]\d{2,4}')  # DD-MM-YYYY o DD/MM/YYYY
+_TXN_REF_RE = re.compile(r'\d{4,}')                     # Número de 4+ dígitos
+_TXN_AMOUNT_RE = re.compile(r'[\d.,]+\d{2}')              # Número con formato de moneda
+
+@lru_cache(maxsize=LINE_CACHE_SIZE)
 def is_bank_transaction(line: str) -> bool:
     """
     Determina si una línea de texto corresponde a un movimiento bancario.
@@ -114,160 +282,102 @@ def is_bank_transaction(line: str) -> bool:
     Returns:
         True si la línea parece ser un movimiento bancario, False en caso contrario
     """
-    # Primero verificamos si es información institucional
-    if is_institutional_info(line):
-        logger.debug(f"Línea rechazada por ser información institucional: {line[:50]}...")
-        return False
-    
     # Ignorar líneas muy cortas o demasiado largas (probablemente no son movimientos)
     if len(line) < 15 or len(line) > 200:
         return False
     
-    # Ignorar líneas que contienen palabras clave típicas de encabezados o información no relevante
-    header_keywords = [
-        "página", "page", "fecha de emisión", "rif", "cliente", "cuenta", 
-        "dirección", "teléfono", "saldo anterior", "total", "subtotal", 
-        "www.", ".com", "http", "consulta", "resumen", "estado de cuenta",
-        "capital autorizado", "capital suscrito", "apartado postal", "mercantil",
-        "banco universal", "correo", "centro de atención", "contacto", "atención",
-        "digitaliza", "actualiza", "impuesto", "resumen estado", "código cliente",
-        "saldo al inicio", "saldo al final", "período", "cheques", "depósitos",
-        "débitos", "créditos", "oficina", "sucursal", "movimientos de cuenta"
-    ]
+    # Toda fecha aceptada por _DATE_RE lleva un separador '-' o '/'; sin ninguno de los dos
+    # la línea se rechaza sin evaluar las expresiones regulares.
+    if '-' not in line and '/' not in line:
+        return False
     
+    # Toda línea aceptada más abajo tiene al menos _MIN_TRANSACTION_DIGITS dígitos: una fecha
+    # seguida de dos montos, o de una referencia de 5+ dígitos. Contar los dígitos ASCII es
+    # mucho más barato que cualquier regex. (Solo en líneas ASCII: \d también acepta dígitos
+    # de otros alfabetos.)
+    if line.isascii() and sum(map(line.count, "0123456789")) < _MIN_TRANSACTION_DIGITS:
+        return False
+    
+    # La línea se pasa a minúsculas una sola vez, después de los descartes anteriores, y
+    # se reutiliza en todas las comprobaciones de texto siguientes, ninguna con IGNORECASE.
     line_lower = line.lower()
-    for keyword in header_keywords:
-        if keyword in line_lower:
-            return False
+    keyword_count, has_header_keyword = _scan_keywords(line_lower)
     
-    # Rechazar líneas que parecen ser encabezados de tabla o información de pie de página
-    if re.search(r'^(fecha|descripción|referencia|monto|importe|saldo|débito|crédito|concepto)$', 
-                line_lower, re.IGNORECASE):
+    # Verificamos si es información institucional
+    if _is_institutional_info(line_lower, keyword_count):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Línea rechazada por ser información institucional: %s...", line[:50])
         return False
     
-    # Rechazar líneas que contienen demasiados caracteres especiales o formatos no típicos
-    # de transacciones bancarias
-    special_chars = sum(1 for c in line if c in '@#$%^&*()_+=[]{}|\\:;"\'<>?')
-    if special_chars > 5:  # Umbral arbitrario, ajustar según necesidad
+    # Ignorar líneas que contienen palabras clave típicas de encabezados o información no relevante
+    if has_header_keyword:
         return False
     
-    # Rechazar líneas que parecen ser información de contacto o direcciones
-    if re.search(r'(tel[éf]fono|fax|correo|e-mail|@|www\.|http|https)', line_lower):
+    # Patrones específicos para identificar líneas que NO son transacciones. Muchas líneas
+    # institucionales llevan fechas y montos, así que se descartan antes de las
+    # comprobaciones de fecha, monto y referencia.
+    if _NON_TRANSACTION_RE.search(line_lower):
         return False
     
-    # Verificar formato de fecha típico de transacciones bancarias
-    # DD/MM o DD-MM seguido de año (opcional)
-    date_formats = [
-        r'\d{1,2}[-/]\d{1,2}(?:[-/]\d{2,4})?',  # DD/MM o DD/MM/YY o DD/MM/YYYY
-        r'\d{2,4}[-/]\d{1,2}[-/]\d{1,2}'         # YYYY/MM/DD o YY/MM/DD
-    ]
-    
-    has_date = False
-    for pattern in date_formats:
-        if re.search(pattern, line):
-            has_date = True
-            break
+    # Rechazar líneas que parecen ser encabezados de tabla o información de pie de página
+    if _TABLE_HEADER_RE.search(line_lower):
+        return False
     
-    if not has_date:
+    # Rechazar líneas que contienen demasiados caracteres especiales o formatos no típicos
+    # de transacciones bancarias
+    special_chars = len(_SPECIAL_CHARS_RE.findall(line))
+    if special_chars > 5:  # Umbral arbitrario, ajustar según necesidad
         return False
     
-    # Verificar si contiene al menos un monto con formato de moneda
-    # Buscamos números que pueden tener separador de miles (.) y decimal (,)
-    money_patterns = [
-        r'(?<!\d)(?:[\d]{1,3}(?:[.,]\d{3})+[.,]\d{2}|[\d]+[.,]\d{2})(?!\d)',  # Formato con decimales
-        r'[\d.,]+\d{2}'  # Patrón más simple como respaldo
-    ]
-    
-    has_amount = False
-    for pattern in money_patterns:
-        amounts = re.findall(pattern, line)
-        if len(amounts) >= 1:
-            has_amount = True
-            break
-    
-    if not has_amount:
+    # Rechazar líneas que parecen ser información de contacto o direcciones
+    if _CONTACT_RE.search(line_lower):
         return False
     
-    # Verificar si contiene alguna referencia numérica (4+ dígitos consecutivos)
-    # Buscar referencias comunes en movimientos bancarios
-    ref_patterns = [
-        r'\d{5,}',                 # Secuencia de 5+ dígitos (más restrictivo)
-        r'[A-Z0-9]{5,}',           # Alfanumérico de 5+ caracteres (posible referencia)
-        r'(?:REF|TRX|ID)[:\s]*\w+' # Palabras clave seguidas de identificadores
-    ]
-    
-    has_ref = False
-    for pattern in ref_patterns:
-        if re.search(pattern, line, re.IGNORECASE):
-            has_ref = True
-            break
-    
-    if not has_ref:
+    # Verificar que contiene una fecha típica de transacciones bancarias, al menos un monto
+    # con formato de moneda y alguna referencia numérica o alfanumérica
+    if not _DATE_AMOUNT_REF_RE.match(line):
         return False
     
-    # Patrones específicos para identificar líneas que NO son transacciones
-    non_transaction_patterns = [
-        r'(?i)RIF\.?\s*[A-Z]-\d+',  # Patrón de RIF (Registro de Información Fiscal)
-        r'(?i)apartado\s+postal',   # Menciones a apartado postal
-        r'(?i)capital\s+(autorizado|suscrito|pagado)',  # Información de capital del banco
-        r'(?i)bs\.?\s*[\d.,]+',     # Mención de cantidades con Bs. (típico en información institucional)
-        r'(?i)mercantil.*banco\s+universal',  # Nombre del banco con su designación
-        r'(?i)caracas\s+\d+',       # Menciones a direcciones con códigos postales
-        r'(?i)venezuela',           # Mención al país
-        r'(?i)c\.?a\.?,?\s*banco',  # Formato de compañía anónima bancaria
-        r'^\s*cuenta\s+\d+\s*$',    # Solo número de cuenta en la línea
-        r'(?i)^(banco|oficina|sucursal)\s*$',  # Encabezados simples
-        r'(?i)^(desde|hasta)\s*$',   # Palabras sueltas de encabezados
-        r'(?i)nro\.?\s*\d+'         # Número de referencia institucional (no transaccional)
-    ]
-    
-    for pattern in non_transaction_patterns:
-        if re.search(pattern, line):
-            return False
-            
     # Verificación específica para líneas que contienen información institucional
     # Si la línea contiene varias palabras clave institucionales juntas, es probable que no sea una transacción
-    institutional_keywords = ["capital", "autorizado", "suscrito", "pagado", "rif", "j-", "apartado", 
-                             "postal", "caracas", "venezuela", "mercantil", "banco universal"]
-    
-    keyword_count = sum(1 for keyword in institutional_keywords if keyword in line_lower)
+    keyword_count = sum(1 for keyword in _TRANSACTION_INSTITUTIONAL_KEYWORDS if keyword in line_lower)
     if keyword_count >= 3:  # Si hay 3 o más palabras clave institucionales, no es una transacción
         return False
     
     # Verificar si la línea tiene estructura de movimiento bancario
     # Un movimiento típico tiene fecha + referencia + descripción + monto + saldo
-    
-    # Patrón para movimientos bancarios comunes
-    # Fecha (DD/MM) + número de referencia + descripción + monto
-    transaction_patterns = [
-        # Formato común: fecha + referencia + descripción + monto
-        r'\d{1,2}[-/]\d{1,2}.*?\d{5,}.*?[\d.,]+\d{2}',
-        # Formato con fecha al inicio y montos al final
-        r'\d{1,2}[-/]\d{1,2}.*?[\d.,]+\d{2}.*?[\d.,]+\d{2}'
-    ]
-    
-    for pattern in transaction_patterns:
-        if re.search(pattern, line):
-            return True
+    if _TRANSACTION_RE.search(line):
+        return True
     
     # Si la línea tiene fecha, referencia y monto pero no coincide con los patrones anteriores,
-    # hacemos una verificación adicional más estricta
-    
-    # Verificar si tiene un patrón de fecha seguido de número de referencia
-    # Este patrón es muy común en movimientos bancarios
-    date_ref_pattern = r'\d{1,2}[-/]\d{1,2}.*?\d{5,}'
-    
-    if re.search(date_ref_pattern, line) and has_amount:
+    # hacemos una verificación adicional más estricta: fecha seguida de número de referencia,
+    # un patrón muy común en movimientos bancarios. (El monto ya se verificó arriba.)
+    if _DATE_REF_RE.search(line):
         # Verificación adicional: la línea no debe ser demasiado larga
         # Las transacciones bancarias suelen ser más concisas que la información institucional
         if len(line) < 120:
             # Verificamos que la línea no tenga características de información general
-            if not re.search(r'(?i)(capital|rif|apartado|banco universal|autorizado|mercantil|c\.a\.|venezuela)', line):
+            if not _GENERAL_INFO_RE.search(line_lower):
                 return True
     
     # Por defecto, rechazamos la línea si no ha pasado las verificaciones anteriores
     return False
 
+def _filter_bank_transactions(lines: List[str]) -> List[str]:
+    """
+    Devuelve, en orden, las líneas que is_bank_transaction considera movimientos bancarios.
+
+    Las condiciones necesarias más baratas (longitud, fecha, monto y referencia) se
+    evalúan de una vez sobre toda la lista con pandas.Series.str; is_bank_transaction
+    solo se llama para las líneas que las superan, por lo que el resultado es el mismo.
+    """
+    if not lines:
+        return []
+    s = pd.Series(lines, dtype=object)
+    mask = s.str.len().between(15, 200)
+    mask &= s.str.contains(_DATE_AMOUNT_REF_RE)
+    return [line for line in s[mask] if is_bank_transaction(line)]
+
 def extract_transaction_data(line: str) -> Tuple[str, str, str, str, str]:
     """
     Extrae los componentes de un movimiento bancario de una línea de texto.
@@ -282,11 +392,11 @@ def extract_transaction_data(line: str) -> Tuple[str, str, str, str, str]:
     # Por ahora, simplemente devolvemos la línea completa como concepto
     
     # Extraer fecha (primera ocurrencia de DD-MM-YYYY o DD/MM/YYYY)
-    date_match = re.search(r'\d{2}[-/]\d{2}[-/]\d{2,4}', line)
+    date_match = _TXN_DATE_RE.search(line)
     date = date_match.group(0) if date_match else ""
     
     # Extraer referencia (primer número de 4+ dígitos)
-    ref_match = re.search(r'\d{4,}', line)
+    ref_match = _TXN_REF_RE.search(line)
     reference = ref_match.group(0) if ref_match else ""
     
     # Para el concepto, necesitaríamos un análisis más detallado del formato específico
@@ -294,7 +404,7 @@ def extract_transaction_data(line: str) -> Tuple[str, str, str, str, str]:
     concept = line
     
     # Extraer montos (últimos dos números con formato de moneda)
-    amount_matches = re.findall(r'[\d.,]+\d{2}', line)
+    amount_matches = _TXN_AMOUNT_RE.findall(line)
     amount = amount_matches[-2] if len(amount_matches) >= 2 else ""
     balance = amount_matches[-1] if amount_matches else ""
     
@@ -302,95 +412,317 @@ def extract_transaction_data(line: str) -> Tuple[str, str, str, str, str]:
 
 # --- Manejadores para cada tipo de archivo ---
 
+class _ExtractionError(list):
+    """
+    Resultado de un manejador que falló: una lista con el mensaje de error como único
+    chunk. Se distingue de una extracción correcta para no guardarla en la caché, ya que
+    el fallo puede ser pasajero.
+    """
+
+# Número de filas que _dataframe_to_rows convierte de una vez. Acota la memoria de la
+# matriz intermedia (df.values) en archivos tabulares grandes.
+TABULAR_BLOCK_ROWS = 10_000
+
+def _dataframe_to_rows(df: pd.DataFrame) -> List[str]:
+    """
+    Convierte cada fila de un DataFrame en un string con sus valores no nulos
+    separados por ", ". Equivale a recorrer el DataFrame con iterrows(), pero
+    operando columna a columna sobre arrays en lugar de construir una Series por fila.
+    """
+    rows = []
+    for start in range(0, len(df), TABULAR_BLOCK_ROWS):
+        # df.values aplica el mismo tipo común que iterrows() usa para cada fila,
+        # de modo que el formato de cada valor coincide con str(item). El tipo común
+        # depende solo de los dtypes de las columnas, así que es el mismo en cada bloque.
+        values = df.iloc[start:start + TABULAR_BLOCK_ROWS].values
+        joined = np.full(len(values), "", dtype=object)
+        for i in range(values.shape[1]):
+            column = values[:, i]
+            present = pd.notna(column)
+            if present.any():
+                joined[present] += ", " + column[present].astype(str).astype(object)
+
+        # Se elimina el separador inicial y se descartan las filas sin ningún valor.
+        rows.extend(row[2:] for row in joined if row)
+    return rows
+
+# Los PDF con al menos PDF_PARALLEL_MIN_PAGES páginas se extraen en paralelo, repartiendo
+# rangos de páginas entre procesos. Por debajo de ese umbral no compensa arrancar el pool.
+PDF_PARALLEL_MIN_PAGES = 16
+# Máximo de procesos: cada uno mantiene su propia copia del PDF en memoria.
+PDF_MAX_WORKERS = 8
+
+# Pool de procesos compartido por todas las peticiones, creado una sola vez (ver
+# start_pdf_pool) en lugar de uno por PDF. Los procesos se arrancan con "forkserver":
+# el proceso de la API tiene muchos hilos (pool de Starlette, asyncio.to_thread, torch,
+# BLAS) y hacer fork en ese estado puede copiar al hijo un lock tomado por otro hilo.
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+def _pdf_pool_workers() -> int:
+    """Número de procesos del pool de extracción de PDF."""
+    return min(os.cpu_count() or 1, PDF_MAX_WORKERS)
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Devuelve el pool de procesos de PDF, creándolo si aún no existe."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=_pdf_pool_workers(),
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _pdf_pool
+
+def _discard_pdf_pool(pool: ProcessPoolExecutor):
+    """Descarta un pool que dejó de funcionar para que la próxima petición cree otro."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def start_pdf_pool():
+    """Crea el pool de procesos de PDF al arrancar la aplicación, si hay más de un núcleo."""
+    if _pdf_pool_workers() > 1:
+        _get_pdf_pool()
+
+def shutdown_pdf_pool():
+    """Detiene el pool de procesos de PDF."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        pool, _pdf_pool = _pdf_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+# Las líneas de menos caracteres no pueden ser movimientos bancarios y se descartan
+# en cuanto se extrae el texto de la página.
+PDF_MIN_LINE_LENGTH = 15
+
+def _page_candidate_lines(text: str) -> List[str]:
+    """
+    Devuelve las líneas de una página ya limpiadas, descartando en la misma pasada las
+    vacías y las demasiado cortas para ser un movimiento.
+    """
+    return [line for raw in text.splitlines() if len(line := raw.strip()) >= PDF_MIN_LINE_LENGTH]
+
+def _rect_union(a: tuple, b: tuple) -> tuple:
+    """Unión de dos rectángulos (x0, y0, x1, y1) con la misma semántica que fitz.Rect.__or__."""
+    if b[0] >= b[2] or b[1] >= b[3]:
+        return a
+    if a[0] >= a[2] or a[1] >= a[3]:
+        return b
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def _sorted_page_text(page: fitz.Page, tolerance: float = 3) -> str:
+    """
+    Equivale a page.get_text("text", sort=True): reconstruye las líneas en orden de lectura
+    uniendo las palabras que están a la misma altura, aunque pertenezcan a bloques distintos
+    (p. ej. las columnas fecha | concepto | monto de una fila de un estado de cuenta).
+
+    PyMuPDF implementa ese reordenamiento en Python creando un fitz.Rect por palabra y por
+    cada unión de rectángulos, lo que domina el coste de la extracción. Aquí se sigue el
+    mismo algoritmo (pymupdf.utils.get_sorted_text) con tuplas de floats.
+    """
+    words = page.get_text("words", flags=fitz.TEXTFLAGS_TEXT)
+    if not words:
+        return ""
+
+    def group_lines(words: list) -> List[Tuple[tuple, list]]:
+        # Agrupa las palabras consecutivas cuyo borde superior o inferior coincide (con
+        # la tolerancia dada) con el de la línea en curso.
+        lines = []
+        line = [words[0]]
+        lrect = words[0][:4]
+        for w in words[1:]:
+            if abs(w[1] - lrect[1]) <= tolerance or abs(w[3] - lrect[3]) <= tolerance:
+                line.append(w)
+                lrect = _rect_union(lrect, w[:4])
+            else:
+                lines.append((lrect, line))
+                line = [w]
+                lrect = w[:4]
+        lines.append((lrect, line))
+        return lines
+
+    # Orden de lectura de las palabras: por línea y, dentro de cada línea, de izquierda a derecha.
+    words.sort(key=lambda w: (w[3], w[0]))
+    words = [w for _, line in group_lines(words) for w in sorted(line, key=lambda w: w[0])]
+
+    totalbox = (fitz.FZ_MAX_INF_RECT, fitz.FZ_MAX_INF_RECT, fitz.FZ_MIN_INF_RECT, fitz.FZ_MIN_INF_RECT)
+    for w in words:
+        totalbox = _rect_union(totalbox, w[:4])
+    clip_x0 = totalbox[0]
+
+    def line_text(line: list) -> str:
+        # La distancia horizontal a la palabra anterior se convierte en espacios.
+        line.sort(key=lambda w: w[0])
+        parts = []
+        x1 = clip_x0
+        for w in line:
+            text = w[4]
+            dist = max(
+                int(round((w[0] - x1) / max(0, w[2] - w[0]) * len(text))),
+                0 if (x1 == clip_x0 or w[0] <= x1) else 1,
+            )
+            parts.append(" " * dist + text)
+            x1 = w[2]
+        return "".join(parts)
+
+    lines = [(lrect, line_text(line)) for lrect, line in group_lines(words)]
+    lines.sort(key=lambda l: l[0][3])
+
+    # La distancia vertical entre líneas se convierte en saltos de línea (como máximo 6).
+    parts = [lines[0][1]]
+    y1 = lines[0][0][3]
+    for lrect, ltext in lines[1:]:
+        distance = min(int(round((lrect[1] - y1) / max(0, lrect[3] - lrect[1]))), 5)
+        parts.append("\n" * (distance + 1))
+        parts.append(ltext)
+        y1 = lrect[3]
+    return "".join(parts)
+
+# Pre-filtro de líneas de PDF: nombres de banco y títulos de secciones del estado de cuenta
+_PDF_BANK_MARKERS = (
+    "Mercantil, C.A., Banco Universal", 
+    "Banco Provincial",
+    "Banco de Venezuela",
+    "Banesco Banco Universal",
+    "Banesco",
+    "BBVA Provincial",
+    "Banco Nacional de Crédito",
+    "Estado de cuenta",
+    "Resumen de movimientos",
+    "Resumen de saldos",
+    "Detalle de movimientos",
+    "TITULAR:",
+    "ESTADO DE CUENTA CORRIENTE",
+    "Nro. de Cuenta:",
+    "Situación al:",
+    "F. OPER",
+    "F. VALOR",
+    "ABONOS",
+    "CARGOS",
+    "SALDO"
+)
+
+# ...y marcas de información institucional que acompañan a esas líneas, buscadas tal cual
+# o sobre la línea en mayúsculas
+_PDF_INSTITUTIONAL_MARKERS = ("Capital", "RIF", "Apartado", "F. OPER", "F. VALOR", "REF.")
+_PDF_INSTITUTIONAL_MARKERS_UPPER = (
+    "RESUMEN", "DETALLE", "CONCEPTO", "DÉBITOS", "CRÉDITOS", "CHEQUES", "MONETARIA",
+    "TITULAR", "CUENTA", "ESTADO DE", "SITUACIÓN", "ABONOS", "CARGOS", "SALDO"
+)
+
+def _passes_pdf_prefilter(line: str) -> bool:
+    """
+    Pre-filtro para eliminar líneas que claramente no son movimientos.
+    Este paso ayuda a eliminar rápidamente encabezados, información institucional, etc.
+    """
+    # Verificar si es información institucional usando la función especializada
+    if is_institutional_info(line):
+        logger.info("Pre-filtro: Línea identificada como información institucional: %s...", line[:50])
+        return False
+    
+    # Filtro explícito para la línea problemática y similares
+    if any(banco in line for banco in _PDF_BANK_MARKERS):
+        line_upper = line.upper()
+        if (any(marker in line for marker in _PDF_INSTITUTIONAL_MARKERS) or
+                any(marker in line_upper for marker in _PDF_INSTITUTIONAL_MARKERS_UPPER)):
+            logger.info("Pre-filtro: Línea de banco con información institucional: %s...", line[:50])
+            return False
+    
+    return True
+
+def _extract_page_lines(page: fitz.Page) -> Tuple[int, List[str]]:
+    """
+    Extrae una página y devuelve (número de líneas candidatas, líneas que superan el pre-filtro).
+    """
+    candidates = _page_candidate_lines(_sorted_page_text(page)) # Orden de lectura natural, como sort=True
+    return len(candidates), [line for line in candidates if _passes_pdf_prefilter(line)]
+
+def _extract_pdf_pages(args: Tuple[bytes, int, int]) -> Tuple[int, List[str]]:
+    """
+    Extrae y pre-filtra las páginas [start, stop) de un PDF.
+
+    Se ejecuta en un proceso del pool, por lo que cada llamada abre su propia copia
+    del documento a partir de los bytes. Tanto la extracción como el pre-filtro se hacen
+    en el proceso hijo, de modo que solo las líneas que lo superan se envían de vuelta
+    al proceso principal.
+    """
+    file_content, start, stop = args
+    candidate_count = 0
+    lines = []
+    with fitz.open(stream=file_content, filetype="pdf") as doc:
+        for i in range(start, stop):
+            page_candidates, page_lines = _extract_page_lines(doc[i])
+            candidate_count += page_candidates
+            lines.extend(page_lines)
+    return candidate_count, lines
+
+def _iter_pdf_pages(doc: fitz.Document, file_content: bytes) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Genera, en orden de lectura, el resultado de _extract_page_lines para todas las
+    páginas del PDF (agrupadas por rangos de páginas si se procesan en paralelo).
+    """
+    page_count = len(doc)
+    logger.info("Procesando PDF con %s páginas.", page_count)
+    workers = min(_pdf_pool_workers(), page_count // PDF_PARALLEL_MIN_PAGES)
+    if workers > 1:
+        # Cada proceso extrae un rango contiguo de páginas; el orden se conserva
+        # porque map devuelve los resultados en el orden de los rangos.
+        bounds = [page_count * w // workers for w in range(workers + 1)]
+        ranges = [(file_content, bounds[w], bounds[w + 1]) for w in range(workers)]
+        pool = _get_pdf_pool()
+        try:
+            results = list(pool.map(_extract_pdf_pages, ranges))
+        except BrokenProcessPool as e:
+            # Un proceso del pool murió (p. ej. por falta de memoria). El pool ya no sirve:
+            # se descarta para que la próxima petición cree otro y este PDF se extrae en serie.
+            logger.warning("El pool de procesos de PDF dejó de funcionar (%s). Se extraerá en serie.", e)
+            _discard_pdf_pool(pool)
+        else:
+            yield from results
+            logger.info("Extracción de texto del PDF completada.")
+            return
+
+    for i, page in enumerate(doc):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Extrayendo texto de la página %d/%d", i + 1, page_count)
+        yield _extract_page_lines(page)
+    logger.info("Extracción de texto del PDF completada.")
+
 def _handle_pdf(file_content: bytes) -> List[str]:
     """
     Extrae texto de un archivo PDF, fragmentando por líneas y filtrando solo los
     movimientos bancarios.
     """
     chunks = []
-    all_lines = []
-    transactions = []
+    candidate_lines = 0
     
     try:
         with fitz.open(stream=file_content, filetype="pdf") as doc:
-            logger.info(f"Procesando PDF con {len(doc)} páginas.")
-            for i, page in enumerate(doc):
-                logger.debug(f"Extrayendo texto de la página {i+1}/{len(doc)}")
-                text = page.get_text("text", sort=True) # sort=True para un orden de lectura más natural
-                all_lines.extend(text.splitlines())
-            logger.info("Extracción de texto del PDF completada.")
-            
-            # Pre-filtro para eliminar líneas que claramente no son movimientos
-            # Este paso ayuda a eliminar rápidamente encabezados, información institucional, etc.
+            # Las líneas se extraen y pre-filtran página a página (ver _extract_page_lines),
+            # sin acumular antes el texto completo.
             filtered_lines = []
-            for line in all_lines:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # Descartar líneas muy cortas
-                if len(line) < 15:
-                    continue
-                
-                # Verificar si es información institucional usando la función especializada
-                if is_institutional_info(line):
-                    logger.info(f"Pre-filtro: Línea identificada como información institucional: {line[:50]}...")
-                    continue
-                
-                # Filtro explícito para la línea problemática y similares
-                if any(banco in line for banco in [
-                    "Mercantil, C.A., Banco Universal", 
-                    "Banco Provincial",
-                    "Banco de Venezuela",
-                    "Banesco Banco Universal",
-                    "Banesco",
-                    "BBVA Provincial",
-                    "Banco Nacional de Crédito",
-                    "Estado de cuenta",
-                    "Resumen de movimientos",
-                    "Resumen de saldos",
-                    "Detalle de movimientos",
-                    "TITULAR:",
-                    "ESTADO DE CUENTA CORRIENTE",
-                    "Nro. de Cuenta:",
-                    "Situación al:",
-                    "F. OPER",
-                    "F. VALOR",
-                    "ABONOS",
-                    "CARGOS",
-                    "SALDO"
-                ]):
-                    if ("Capital" in line or "RIF" in line or "Apartado" in line or 
-                        "RESUMEN" in line.upper() or "DETALLE" in line.upper() or 
-                        "CONCEPTO" in line.upper() or "DÉBITOS" in line.upper() or
-                        "CRÉDITOS" in line.upper() or "CHEQUES" in line.upper() or
-                        "MONETARIA" in line.upper() or "TITULAR" in line.upper() or
-                        "CUENTA" in line.upper() or "ESTADO DE" in line.upper() or
-                        "SITUACIÓN" in line.upper() or "ABONOS" in line.upper() or
-                        "CARGOS" in line.upper() or "SALDO" in line.upper() or
-                        "F. OPER" in line or "F. VALOR" in line or "REF." in line):
-                        logger.info(f"Pre-filtro: Línea de banco con información institucional: {line[:50]}...")
-                        continue
-                
-                filtered_lines.append(line)
+            for page_candidates, page_lines in _iter_pdf_pages(doc, file_content):
+                candidate_lines += page_candidates
+                filtered_lines.extend(page_lines)
             
             # Filtrar solo las líneas que parecen ser movimientos bancarios
-            for line in filtered_lines:
-                if is_bank_transaction(line):
-                    transactions.append(line)
-                    
-                    # Opcionalmente, podemos extraer los componentes estructurados
-                    # date, ref, concept, amount, balance = extract_transaction_data(line)
-                    # formatted_transaction = f"Fecha: {date} | Ref: {ref} | Concepto: {concept} | Monto: {amount} | Saldo: {balance}"
-                    # chunks.append(formatted_transaction)
-                    
-                    # Por ahora, simplemente agregamos la línea completa
-                    chunks.append(line)
+            for line in _filter_bank_transactions(filtered_lines):
+                # Opcionalmente, podemos extraer los componentes estructurados
+                # date, ref, concept, amount, balance = extract_transaction_data(line)
+                # formatted_transaction = f"Fecha: {date} | Ref: {ref} | Concepto: {concept} | Monto: {amount} | Saldo: {balance}"
+                # chunks.append(formatted_transaction)
+                
+                # Por ahora, simplemente agregamos la línea completa
+                chunks.append(line)
                     
-            logger.info(f"Se identificaron {len(chunks)} movimientos bancarios de {len(all_lines)} líneas totales.")
+            logger.info("Se identificaron %s movimientos bancarios de %s líneas candidatas.", len(chunks), candidate_lines)
     except Exception as e:
-        logger.error(f"Error procesando el archivo PDF: {e}", exc_info=True)
-        return [f"Error procesando el archivo PDF: {e}"]
+        logger.error("Error procesando el archivo PDF: %s", e, exc_info=True)
+        return _ExtractionError([f"Error procesando el archivo PDF: {e}"])
     
     return chunks
 
@@ -405,129 +737,267 @@ def _handle_tabular(file_content: bytes, extension: str) -> List[str]:
     df_list = [] # read_html devuelve una lista de DataFrames
 
     try:
-        logger.info(f"Procesando archivo tabular con extensión {extension}.")
+        logger.info("Procesando archivo tabular con extensión %s.", extension)
         if extension == ".csv":
             df = pd.read_csv(io.BytesIO(file_content))
             df_list.append(df)
-        elif extension == ".xls":
-            df = pd.read_excel(io.BytesIO(file_content), engine='xlrd')
-            df_list.append(df)
-        else:  # .xlsx
-            df = pd.read_excel(io.BytesIO(file_content))
+        else:  # .xls / .xlsx
+            # calamine (Rust) lee tanto .xls como .xlsx y es bastante más rápido que xlrd/openpyxl.
+            df = pd.read_excel(io.BytesIO(file_content), engine='calamine')
             df_list.append(df)
         
-        logger.info(f"Archivo tabular cargado exitosamente como formato Excel.")
+        logger.info("Archivo tabular cargado exitosamente como formato Excel.")
 
     except Exception as e:
         # Si falla la lectura como Excel, intentamos como HTML.
         # Esto es común para archivos .xls exportados desde sistemas web.
-        logger.warning(f"Falló la lectura como Excel ({e}). Intentando leer como tabla HTML.")
+        logger.warning("Falló la lectura como Excel (%s). Intentando leer como tabla HTML.", e)
         try:
-            # read_html espera una string, no bytes, así que decodificamos.
+            # read_html espera texto, no bytes, así que decodificamos una sola vez.
             # Usamos 'ignore' para evitar errores con caracteres extraños.
-            html_string = file_content.decode('utf-8', errors='ignore')
-            # read_html devuelve una lista de todos los dataframes encontrados en el HTML
-            dfs = pd.read_html(io.StringIO(html_string))
+            # pandas ya no acepta HTML literal como string (lo interpreta como ruta),
+            # por eso se sigue envolviendo en StringIO.
+            # read_html devuelve una lista de todos los dataframes encontrados en el HTML.
+            # Se fija el parser lxml (dependencia del proyecto) para que no se intente
+            # después con BeautifulSoup/html5lib, que no están instalados.
+            dfs = pd.read_html(io.StringIO(file_content.decode('utf-8', errors='ignore')), flavor='lxml')
             df_list.extend(dfs)
-            logger.info(f"Archivo leído exitosamente como HTML. Se encontraron {len(df_list)} tablas.")
+            logger.info("Archivo leído exitosamente como HTML. Se encontraron %s tablas.", len(df_list))
         except Exception as html_error:
             # Si ambos fallan, registramos el error final y retornamos.
-            logger.error(f"Error procesando el archivo como Excel y como HTML: {html_error}", exc_info=True)
-            return [f"Error procesando archivo: No es un formato de tabla válido (Excel/HTML). Error: {html_error}"]
+            logger.error("Error procesando el archivo como Excel y como HTML: %s", html_error, exc_info=True)
+            return _ExtractionError([f"Error procesando archivo: No es un formato de tabla válido (Excel/HTML). Error: {html_error}"])
 
     # Procesar todos los DataFrames encontrados (normalmente uno, pero pueden ser más si es HTML)
     for df in df_list:
-        logger.info(f"Procesando un DataFrame con {len(df)} filas.")
-        for _, row in df.iterrows():
-            row_str = ", ".join(str(item) for item in row.dropna().values)
-            if row_str:
-                all_rows.append(row_str)
+        logger.info("Procesando un DataFrame con %s filas.", len(df))
+        all_rows.extend(_dataframe_to_rows(df))
     
     # Filtrar solo las filas que parecen ser movimientos bancarios
-    transactions = []
-    for row in all_rows:
-        row = row.strip()
-        if row and is_bank_transaction(row):
-            transactions.append(row)
-            chunks.append(row)
-    
-    logger.info(f"Se identificaron {len(chunks)} movimientos bancarios de {len(all_rows)} filas totales.")
+    transactions = _filter_bank_transactions([row.strip() for row in all_rows])
+    chunks.extend(transactions)
+    
+    logger.info("Se identificaron %s movimientos bancarios de %s filas totales.", len(chunks), len(all_rows))
     return chunks
 
+# Si tesserocr está instalado, el OCR usa instancias de la API de Tesseract que se
+# inicializan (carga de modelos de idioma incluida) una sola vez y se reutilizan, en lugar
+# de lanzar un subproceso de tesseract en cada llamada como hace pytesseract.
+# Cada instancia no es segura entre hilos, así que se mantiene un pool de hasta
+# TESSERACT_POOL_SIZE instancias, creadas bajo demanda; cada llamada toma una en exclusiva
+# y la devuelve al terminar. tesserocr libera el GIL durante el reconocimiento, de modo que
+# varias imágenes pueden procesarse a la vez.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Modo de segmentación de página de Tesseract: 6 = un único bloque de texto uniforme.
+# Los estados de cuenta son tablas de líneas homogéneas, así que se evita el análisis
+# completo de la maquetación del modo por defecto (3), bastante más lento.
+OCR_PSM = 6
+_TESS_CONFIG = f"--psm {OCR_PSM}"
+
+TESSERACT_POOL_SIZE = int(os.getenv("TESSERACT_POOL_SIZE", min(4, os.cpu_count() or 1)))
+
+_TESSERACT_POOL: "queue.Queue" = queue.Queue()
+_tess_created = 0
+_tess_lock = threading.Lock()
+
+def _acquire_tess_api():
+    """
+    Toma una instancia libre del pool de tesserocr, creándola si aún no se alcanzó
+    TESSERACT_POOL_SIZE y esperando a que se libere una en caso contrario.
+    Devuelve None si tesserocr no se puede inicializar.
+    """
+    global _tess_created, tesserocr
+    try:
+        return _TESSERACT_POOL.get_nowait()
+    except queue.Empty:
+        pass
+    with _tess_lock:
+        # Se vuelve a comprobar con el lock tomado: otro hilo puede haber fallado al
+        # inicializar tesserocr mientras este esperaba.
+        if tesserocr is None:
+            return None
+        if _tess_created < TESSERACT_POOL_SIZE:
+            try:
+                api = tesserocr.PyTessBaseAPI(psm=OCR_PSM)
+            except RuntimeError as e:
+                # Normalmente no encuentra los datos de idioma (ver TESSDATA_PREFIX).
+                logger.warning("No se pudo inicializar tesserocr (%s). Se usará pytesseract.", e)
+                if _tess_created == 0:
+                    tesserocr = None
+            else:
+                _tess_created += 1
+                return api
+        # Solo se espera a que se libere una instancia si existe alguna; si no, nunca llegaría.
+        if _tess_created == 0:
+            return None
+    return _TESSERACT_POOL.get()
+
+# Con OCR_ENGINE=easyocr el OCR se hace con EasyOCR, que ejecuta detección y reconocimiento
+# en la GPU cuando hay una disponible. Solo compensa si el servicio procesa imágenes de
+# forma continua; por defecto se usa Tesseract. Si easyocr no está instalado, se usa Tesseract.
+OCR_ENGINE = os.getenv("OCR_ENGINE", "tesseract").lower()
+EASYOCR_LANGUAGES = ["es", "en"]
+
+_easyocr_reader = None
+_easyocr_lock = threading.Lock()
+
+def _get_easyocr_reader():
+    """Devuelve el lector de EasyOCR, creándolo en la primera llamada, o None si no está disponible."""
+    global _easyocr_reader, OCR_ENGINE
+    with _easyocr_lock:
+        if _easyocr_reader is None:
+            try:
+                import easyocr
+                import torch
+            except ImportError:
+                logger.warning("OCR_ENGINE=easyocr pero easyocr no está instalado. Se usará Tesseract.")
+                OCR_ENGINE = "tesseract"
+                return None
+            _easyocr_reader = easyocr.Reader(EASYOCR_LANGUAGES, gpu=torch.cuda.is_available())
+    return _easyocr_reader
+
+def _ocr_image(image: Image.Image) -> str:
+    """
+    Devuelve el texto reconocido en la imagen: con EasyOCR si así se configura y, si no,
+    con tesserocr si está disponible o con pytesseract en caso contrario.
+    """
+    if OCR_ENGINE == "easyocr":
+        reader = _get_easyocr_reader()
+        if reader is not None:
+            # EasyOCR devuelve un texto por cada región detectada; se unen como líneas.
+            return "\n".join(reader.readtext(np.asarray(image), detail=0, paragraph=False))
+    if tesserocr is not None:
+        api = _acquire_tess_api()
+        if api is not None:
+            try:
+                api.SetImage(image)
+                return api.GetUTF8Text()
+            finally:
+                _TESSERACT_POOL.put(api)
+    return pytesseract.image_to_string(image, config=_TESS_CONFIG)
+
+# Parámetros del umbral adaptativo aplicado antes del OCR: tamaño (impar) del vecindario
+# en píxeles y constante que se resta a la media ponderada del vecindario.
+OCR_THRESHOLD_BLOCK_SIZE = 31
+OCR_THRESHOLD_C = 10
+
+def _preprocess_for_ocr(image: Image.Image) -> Image.Image:
+    """
+    Convierte la imagen a escala de grises y la binariza con un umbral adaptativo
+    gaussiano. Tesseract trabaja menos y reconoce mejor el texto sobre una imagen
+    binaria limpia que sobre la imagen original en color.
+    """
+    gray = image.convert("L")
+    binary = cv2.adaptiveThreshold(
+        np.asarray(gray), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+        OCR_THRESHOLD_BLOCK_SIZE, OCR_THRESHOLD_C,
+    )
+    return Image.fromarray(binary)
+
 def _handle_image(file_content: bytes) -> List[str]:
     """Extrae texto de un archivo de imagen usando OCR, fragmentando por líneas."""
-    chunks = []
     try:
-        logger.info("Procesando archivo de imagen con Tesseract OCR.")
-        image = Image.open(io.BytesIO(file_content))
+        logger.info("Procesando archivo de imagen con OCR (%s).", OCR_ENGINE)
+        image = _preprocess_for_ocr(Image.open(io.BytesIO(file_content)))
         # Se puede especificar el idioma si se conoce, ej. lang='eng+spa'
-        text = pytesseract.image_to_string(image)
-        chunks.extend(text.splitlines())
-        logger.info(f"OCR completado. Se extrajeron {len(chunks)} líneas.")
+        text = _ocr_image(image)
+        lines = text.splitlines()
+        logger.info("OCR completado. Se extrajeron %s líneas.", len(lines))
     except Exception as e:
-        logger.error(f"Error procesando el archivo de imagen: {e}", exc_info=True)
-        return [f"Error procesando el archivo de imagen: {e}"]
+        logger.error("Error procesando el archivo de imagen: %s", e, exc_info=True)
+        return _ExtractionError([f"Error procesando el archivo de imagen: {e}"])
     
-    return [chunk.strip() for chunk in chunks if chunk.strip()]
+    # Cada línea se limpia una sola vez.
+    return [chunk for line in lines if (chunk := line.strip())]
 
 def _handle_text(file_content: bytes) -> List[str]:
     """Extrae texto de un archivo de texto plano, fragmentando por líneas."""
-    chunks = []
     try:
         logger.info("Procesando como archivo de texto plano.")
-        # Intenta decodificar con UTF-8, el más común
-        text = file_content.decode('utf-8')
-        chunks.extend(text.splitlines())
+        if file_content.isascii():
+            # Las exportaciones bancarias suelen ser ASCII puro: bytes.isascii() es una
+            # comprobación muy rápida y el decodificador ASCII es el más barato. El
+            # resultado es el mismo que con UTF-8, del que ASCII es un subconjunto.
+            text = file_content.decode('ascii')
+        else:
+            # Intenta decodificar con UTF-8, el más común
+            text = file_content.decode('utf-8')
         logger.info("Decodificación con UTF-8 exitosa.")
     except UnicodeDecodeError:
         logger.warning("Falló la decodificación con UTF-8, intentando con latin-1.")
         try:
             # Si falla, intenta con latin-1, común en algunos sistemas
             text = file_content.decode('latin-1')
-            chunks.extend(text.splitlines())
             logger.info("Decodificación con latin-1 exitosa.")
         except Exception as e:
-            logger.error(f"Error de decodificación en el archivo de texto: {e}", exc_info=True)
-            return [f"Error de decodificación en el archivo de texto: {e}"]
-            
-    return [chunk.strip() for chunk in chunks if chunk.strip()]
+            logger.error("Error de decodificación en el archivo de texto: %s", e, exc_info=True)
+            return _ExtractionError([f"Error de decodificación en el archivo de texto: {e}"])
+
+    # El texto decodificado se fragmenta una sola vez, sin copiar antes las líneas a una lista intermedia.
+    return [chunk for line in text.splitlines() if (chunk := line.strip())]
 
 # --- Función principal de despacho ---
 
-def extract_chunks_from_file(file_content: bytes, filename: str) -> List[str]:
+# Manejador de cada extensión conocida. La tabla se construye una sola vez al importar el
+# módulo; la extensión de los archivos tabulares queda fijada con functools.partial.
+_EXTENSION_HANDLERS: Dict[str, Callable[[bytes], List[str]]] = {
+    ".pdf": _handle_pdf,
+    **{ext: partial(_handle_tabular, extension=ext) for ext in (".xls", ".xlsx", ".csv")},
+    **dict.fromkeys((".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff"), _handle_image),
+    **dict.fromkeys((".txt", ".md", ".py", ".js", ".html", ".css"), _handle_text),
+}
+
+# Caché LRU de resultados de extracción, indexada por extensión y hash BLAKE3 del contenido
+# (el que main.py ya calcula al recibir el archivo). Volver a subir el mismo archivo (p. ej.
+# a la otra colección o tras limpiarla) evita repetir la extracción de PDF, OCR o Excel.
+# Solo se guardan las extracciones correctas.
+EXTRACT_CACHE_SIZE = 32
+_extract_cache: "OrderedDict[Tuple[str, str], List[str]]" = OrderedDict()
+_extract_cache_lock = threading.Lock()
+
+def extract_chunks_from_file(file_content: bytes, filename: str, file_hash: Optional[str] = None) -> List[str]:
     """
     Extrae fragmentos de texto de un archivo basándose en su extensión.
 
     Args:
         file_content: El contenido en bytes del archivo.
         filename: El nombre del archivo.
+        file_hash: El hash del contenido, usado como clave de la caché de extracciones.
+            Sin él no se usa la caché.
 
     Returns:
         Una lista de fragmentos de texto extraídos del archivo.
     """
     extension = pathlib.Path(filename).suffix.lower()
-    logger.info(f"Iniciando extracción de chunks para el archivo '{filename}' con extensión '{extension}'.")
+    logger.info("Iniciando extracción de chunks para el archivo '%s' con extensión '%s'.", filename, extension)
+
+    cache_key = (extension, file_hash)
+    with _extract_cache_lock:
+        cached = _extract_cache.get(cache_key) if file_hash is not None else None
+        if cached is not None:
+            _extract_cache.move_to_end(cache_key)
+    if cached is not None:
+        logger.info("Contenido ya extraído previamente; se reutilizan %s chunks de la caché.", len(cached))
+        return list(cached)
 
     # Obtener los chunks según el tipo de archivo
-    if extension == ".pdf":
-        chunks = _handle_pdf(file_content)
-    elif extension in [".xls", ".xlsx", ".csv"]:
-        chunks = _handle_tabular(file_content, extension)
-    elif extension in [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff"]:
-        chunks = _handle_image(file_content)
-    elif extension in [".txt", ".md", ".py", ".js", ".html", ".css"]:
-        chunks = _handle_text(file_content)
-    else:
-        logger.warning(f"Extensión '{extension}' no reconocida. Intentando procesar como archivo de texto plano por defecto.")
+    handler = _EXTENSION_HANDLERS.get(extension)
+    if handler is None:
+        logger.warning("Extensión '%s' no reconocida. Intentando procesar como archivo de texto plano por defecto.", extension)
         # Como fallback, intenta procesarlo como un archivo de texto.
-        chunks = _handle_text(file_content)
+        handler = _handle_text
+    chunks = handler(file_content)
     
     # Filtro final para asegurarnos de que no pasan líneas institucionales
     filtered_chunks = []
     for chunk in chunks:
         # Usar la función especializada para detectar información institucional
         if is_institutional_info(chunk):
-            logger.info(f"Filtro final: Eliminada línea institucional: {chunk[:50]}...")
+            logger.info("Filtro final: Eliminada línea institucional: %s...", chunk[:50])
             continue
             
         # Filtro explícito para líneas de bancos conocidos con información institucional
@@ -546,10 +1016,17 @@ def extract_chunks_from_file(file_content: bytes, filename: str) -> List[str]:
                 "CONCEPTO", "DÉBITOS", "CRÉDITOS", "CHEQUES", "MONETARIA",
                 "EXPANSIÓN", "REPÚBLICA", "BOLIVARIANA", "NACIONAL"
             ]):
-                logger.info(f"Filtro final: Eliminada línea de banco con información institucional: {chunk[:50]}...")
+                logger.info("Filtro final: Eliminada línea de banco con información institucional: %s...", chunk[:50])
                 continue
             
         filtered_chunks.append(chunk)
     
-    logger.info(f"Filtrado final: {len(chunks) - len(filtered_chunks)} chunks eliminados por filtros institucionales.")
+    logger.info("Filtrado final: %s chunks eliminados por filtros institucionales.", len(chunks) - len(filtered_chunks))
+
+    if file_hash is not None and not isinstance(chunks, _ExtractionError):
+        with _extract_cache_lock:
+            _extract_cache[cache_key] = list(filtered_chunks)
+            _extract_cache.move_to_end(cache_key)
+            while len(_extract_cache) > EXTRACT_CACHE_SIZE:
+                _extract_cache.popitem(last=False)
     return filtered_chunks
@@ -1,24 +1,77 @@
+import logging
 import numpy as np
 import re
+from functools import lru_cache
 from logging_config import logger
 
-def calculate_cosine_similarity(vec1: list[float], vec2: list[float]) -> float:
+def calculate_cosine_similarity(vec1: list[float], vec2: list[float], normalized: bool = False) -> float:
     """
     Calcula la similitud de coseno entre dos vectores.
+
+    Si ambos vectores ya están normalizados (norma L2 = 1), el coseno es
+    directamente su producto punto y se omite el cálculo de las normas.
     """
     # CORRECCIÓN: Comprobar explícitamente si los vectores son None o están vacíos.
     if vec1 is None or vec2 is None or len(vec1) == 0 or len(vec2) == 0:
         return 0.0
         
-    v1 = np.array(vec1)
-    v2 = np.array(vec2)
-    dot_product = np.dot(v1, v2)
-    norm_v1 = np.linalg.norm(v1)
-    norm_v2 = np.linalg.norm(v2)
+    # np.asarray no copia los embeddings que ya llegan como arrays de numpy.
+    v1 = np.asarray(vec1)
+    v2 = np.asarray(vec2)
+    dot_product = v1 @ v2
+    if normalized:
+        return float(dot_product)
+    norm_v1 = np.sqrt(v1 @ v1)
+    norm_v2 = np.sqrt(v2 @ v2)
     epsilon = 1e-8
     similarity = dot_product / ((norm_v1 * norm_v2) + epsilon)
     return float(similarity)
 
+def calculate_cosine_similarity_batch(A: np.ndarray, B: np.ndarray, normalized: bool = False) -> np.ndarray:
+    """
+    Calcula la matriz de similitud de coseno entre cada fila de A (N x D) y cada fila
+    de B (M x D) con una sola multiplicación de matrices.
+
+    Cada vector se normaliza una única vez en lugar de en cada par. Si ambas matrices
+    ya están normalizadas (norma L2 = 1 por fila), se omite ese paso.
+
+    Returns:
+        Un array float32 de forma (N, M).
+    """
+    A = np.asarray(A, dtype=np.float32)
+    B = np.asarray(B, dtype=np.float32)
+    if not normalized:
+        A = A / (np.linalg.norm(A, axis=1, keepdims=True) + 1e-8)
+        B = B / (np.linalg.norm(B, axis=1, keepdims=True) + 1e-8)
+    return A @ B.T
+
+# Palabras clave que indican información institucional
+_INSTITUTIONAL_KEYWORDS = [
+    "banco", "universal", "capital", "autorizado", "suscrito", "pagado",
+    "rif", "j-", "apartado", "postal", "c.a.", "s.a.", "compañía anónima",
+    "mercantil", "banesco", "bbva", "provincial", "venezuela", "estado de cuenta",
+    "resumen de movimientos", "detalle de movimientos", "titular", "situación al",
+    "nro. de cuenta", "f. oper", "f. valor", "abonos", "cargos", "saldo"
+]
+
+# Patrones específicos de información institucional, precompilados en una sola alternancia.
+# Se escriben en minúsculas y se buscan en el texto ya pasado a minúsculas, sin IGNORECASE.
+_INSTITUTIONAL_RE = re.compile("|".join(f"(?:{pattern})" for pattern in [
+    r'banco\s+\w+',  # Nombre de banco
+    r'capital\s+(autorizado|suscrito|pagado)',  # Información de capital
+    r'rif\.?\s*[a-z]-\d+',  # Formato de RIF
+    r'apartado\s+postal',  # Apartado postal
+    r'estado\s+de\s+cuenta',  # Título del estado de cuenta
+    r'titular\s*:',  # Titular de la cuenta
+    r'situaci[óo]n\s+al\s*:',  # Fecha de situación
+    r'nro\.\s+de\s+cuenta\s*:',  # Número de cuenta
+]))
+
+# Un mismo chunk se compara con muchos otros al construir la matriz de matching, así que
+# los resultados por texto se cachean.
+TEXT_CACHE_SIZE = 8192
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
 def is_institutional_info(text: str) -> bool:
     """
     Determina si un texto contiene información institucional bancaria.
@@ -32,37 +85,42 @@ def is_institutional_info(text: str) -> bool:
     # Convertir a minúsculas para comparaciones insensibles a mayúsculas/minúsculas
     text_lower = text.lower()
     
-    # Lista de palabras clave que indican información institucional
-    institutional_keywords = [
-        "banco", "universal", "capital", "autorizado", "suscrito", "pagado",
-        "rif", "j-", "apartado", "postal", "c.a.", "s.a.", "compañía anónima",
-        "mercantil", "banesco", "bbva", "provincial", "venezuela", "estado de cuenta",
-        "resumen de movimientos", "detalle de movimientos", "titular", "situación al",
-        "nro. de cuenta", "f. oper", "f. valor", "abonos", "cargos", "saldo"
-    ]
-    
     # Verificar si contiene al menos 2 palabras clave institucionales
-    keyword_count = sum(1 for keyword in institutional_keywords if keyword in text_lower)
+    keyword_count = sum(1 for keyword in _INSTITUTIONAL_KEYWORDS if keyword in text_lower)
     if keyword_count >= 2:
         return True
     
-    # Patrones específicos de información institucional
-    institutional_patterns = [
-        r'(?i)banco\s+\w+',  # Nombre de banco
-        r'(?i)capital\s+(autorizado|suscrito|pagado)',  # Información de capital
-        r'(?i)rif\.?\s*[a-z]-\d+',  # Formato de RIF
-        r'(?i)apartado\s+postal',  # Apartado postal
-        r'(?i)estado\s+de\s+cuenta',  # Título del estado de cuenta
-        r'(?i)titular\s*:',  # Titular de la cuenta
-        r'(?i)situaci[óo]n\s+al\s*:',  # Fecha de situación
-        r'(?i)nro\.\s+de\s+cuenta\s*:',  # Número de cuenta
-    ]
-    
-    for pattern in institutional_patterns:
-        if re.search(pattern, text):
-            return True
-    
-    return False
+    return _INSTITUTIONAL_RE.search(text_lower) is not None
+
+@lru_cache(maxsize=16)
+def _code_regex(min_digits: int) -> re.Pattern:
+    """
+    Expresión regular para encontrar secuencias de 'min_digits' o más dígitos, compilada
+    una sola vez por valor de min_digits.
+    """
+    return re.compile(rf'\d{{{min_digits},}}')
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def extract_codes(text: str, min_digits: int) -> frozenset:
+    """
+    Devuelve el conjunto de "códigos" (secuencias de 'min_digits' o más dígitos) de un texto.
+    Es inmutable porque el resultado se comparte entre llamadas a través de la caché.
+    """
+    return frozenset(_code_regex(min_digits).findall(text))
+
+def has_structural_codes(text: str, min_digits: int = 5) -> bool:
+    """
+    Indica si un texto puede tener similitud estructural con algún otro, es decir,
+    si no es información institucional y contiene al menos un código numérico.
+
+    Permite descartar de antemano los textos que nunca coincidirán, sin compararlos par a par.
+    """
+    if is_institutional_info(text):
+        return False
+    # Se usa extract_codes (cacheada) en lugar de una búsqueda suelta: así, al precalcular
+    # esto para todos los chunks, quedan también en caché los códigos que después usa
+    # calculate_structural_similarity en cada comparación.
+    return bool(extract_codes(text, min_digits))
 
 def calculate_structural_similarity(text1: str, text2: str, min_digits: int = 5) -> float:
     """
@@ -79,26 +137,30 @@ def calculate_structural_similarity(text1: str, text2: str, min_digits: int = 5)
     """
     # Verificar si alguno de los textos contiene información institucional
     if is_institutional_info(text1) or is_institutional_info(text2):
-        logger.info(f"Similitud estructural: Detectada información institucional, retornando 0.0")
-        logger.debug(f"Texto 1: {text1[:50]}...")
-        logger.debug(f"Texto 2: {text2[:50]}...")
+        logger.info("Similitud estructural: Detectada información institucional, retornando 0.0")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Texto 1: %s...", text1[:50])
+            logger.debug("Texto 2: %s...", text2[:50])
         return 0.0  # No permitir coincidencias con información institucional
     
-    # Expresión regular para encontrar secuencias de 'min_digits' o más dígitos.
+    # Extraer todos los "códigos" (secuencias de 'min_digits' o más dígitos) de cada texto.
     # Esto ayuda a filtrar números pequeños y enfocarse en posibles IDs o referencias.
-    regex = re.compile(rf'\d{{{min_digits},}}')
-    
-    # Extraer todos los "códigos" de cada texto.
-    codes1 = set(regex.findall(text1))
-    codes2 = set(regex.findall(text2))
+    codes1 = extract_codes(text1, min_digits)
+    codes2 = extract_codes(text2, min_digits)
 
     if not codes1 or not codes2:
         return 0.0
 
-    # Comprobar si algún código de una lista es un substring de un código de la otra.
-    for c1 in codes1:
-        for c2 in codes2:
-            if c1 in c2 or c2 in c1:
+    # Un código presente en ambos textos es coincidencia directa: basta una intersección de conjuntos.
+    if not codes1.isdisjoint(codes2):
+        return 1.0
+
+    # Si no, comprobar si algún código de una lista es un substring de un código de la otra.
+    # Dos códigos distintos de igual longitud no pueden contenerse, así que solo se buscan
+    # los códigos de cada lista dentro de los más largos de la otra.
+    for codes, other in ((codes1, codes2), (codes2, codes1)):
+        for code in codes:
+            if any(code in longer for longer in other if len(longer) > len(code)):
                 return 1.0  # Se encontró una coincidencia
 
     return 0.0  # No se encontraron coincidencias